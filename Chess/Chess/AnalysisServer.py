@@ -0,0 +1,228 @@
+"""
+Local HTTP/JSON analysis server. Searches run in a pool of engine worker processes, so one host can answer many
+clients at once. Start it with:  chess-server --port 8080
+
+POST /analyse with a JSON body such as {"fen": "<fen>", "depth": 3, "movetime": 1000, "nodes": 20000}
+(movetime in milliseconds, every limit optional) answers {"bestmove": "e2e4", "score": 0.2, "pv": [...], ...}.
+GET /health answers the number of requests waiting and running.
+When the queue is full the server answers 503 at once, 504 when a search takes longer than the timeout and 500 when
+it fails.
+Results are cached, and a request for a position that is being searched with the same limits waits for that search.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import time
+
+from . import ChessEngine, ResultCache, SmartMoveFinder, Tablebase
+
+MAX_BODY = 1 << 16  # bytes
+MAX_DEPTH = 32  # for searches limited by time or nodes only
+RESULT_MARGIN = 0.25  # seconds before the request timeout at which a search stops and answers with what it has
+
+
+'''
+Runs once in every worker process: map the tablebase files and run a small search, so the first real request doesn't
+pay for loading the tables.
+'''
+def initWorker():
+    if os.path.isdir(Tablebase.TABLEBASE_PATH):
+        for name in os.listdir(Tablebase.TABLEBASE_PATH):
+            if name.endswith(".bin"):
+                Tablebase.getTable(name[:-4])
+    gs = ChessEngine.GameState()
+    SmartMoveFinder.searchPosition(gs, gs.getValidMoves(), 1)
+
+
+def warmUp():
+    return os.getpid()
+
+
+'''
+Runs in a worker process. timeLimit is in seconds and bounds the search even when the request asks for more.
+'''
+def analyse(fen, depth, movetime, nodes, timeLimit):
+    gs = ChessEngine.GameState()
+    gs.loadFEN(fen)
+    validMoves = gs.getValidMoves()
+    if len(validMoves) == 0:
+        return {"bestmove": None, "checkmate": gs.checkmate, "stalemate": gs.stalemate}
+    searchTime = timeLimit if movetime is None else min(timeLimit, movetime / 1000)
+    if depth is None:
+        depth = MAX_DEPTH if movetime is not None or nodes is not None else SmartMoveFinder.DEPTH
+    depthReached = 0
+
+    def onIteration(iterationDepth, score, pv):
+        nonlocal depthReached
+        depthReached = iterationDepth
+
+    SmartMoveFinder.newGame()  # requests are independent positions
+    move, score, pv = SmartMoveFinder.searchPosition(gs, validMoves, depth, nodes, time.monotonic() + searchTime,
+                                                     onIteration=onIteration)
+    if move is None: # out of time before the first iteration finished
+        move, pv = SmartMoveFinder.findRandomMove(validMoves), []
+    stats = SmartMoveFinder.searchStats
+    return {"bestmove": move.getUciNotation(), "score": score, "pv": [m.getUciNotation() for m in pv],
+            "depth": depthReached, "nodes": stats["nodes"] + stats["quiescenceNodes"]}
+
+
+class AnalysisServer():
+    def __init__(self, workers, maxQueue, timeout):
+        self.workers = workers
+        self.maxQueue = maxQueue  # requests waiting or running, more are turned away
+        self.timeout = timeout  # seconds per request, waiting included
+        self.pending = 0
+        self.slots = asyncio.Semaphore(workers)
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=initWorker)
+        self.cache = ResultCache.ResultCache()
+        self.inFlight = {}  # (positionKey, limits) -> task of the search running for them
+
+    async def start(self, host, port):
+        loop = asyncio.get_running_loop()
+        # start every worker process now rather than on the first requests
+        await asyncio.gather(*[loop.run_in_executor(self.pool, warmUp) for i in range(self.workers)])
+        return await asyncio.start_server(self.handleClient, host, port)
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    async def handleClient(self, reader, writer):
+        try:
+            status, body = await self.handleRequest(reader)
+        except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            status, body = 400, {"error": "bad request"}
+        data = json.dumps(body).encode()
+        writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n"
+                      "Connection: close\r\n\r\n" % (status, STATUS_TEXT[status], len(data))).encode() + data)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def handleRequest(self, reader):
+        requestLine = (await reader.readline()).decode("latin-1").split()
+        if len(requestLine) < 2:
+            raise ValueError("bad request line")
+        method, path = requestLine[0], requestLine[1]
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if line == "":
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if method == "GET" and path == "/health":
+            return 200, {"pending": self.pending, "workers": self.workers}
+        if path != "/analyse":
+            return 404, {"error": "not found"}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+        length = int(headers.get("content-length", "0"))
+        if length > MAX_BODY:
+            return 413, {"error": "body too large"}
+        request = json.loads(await reader.readexactly(length))
+        fen = request.get("fen") if isinstance(request, dict) else None
+        if not isinstance(fen, str):
+            return 400, {"error": "fen is required"}
+        gs = ChessEngine.GameState()
+        try:
+            gs.loadFEN(fen)
+        except (ValueError, IndexError, KeyError):
+            return 400, {"error": "bad fen"}
+        limits = []
+        for name in ("depth", "movetime", "nodes"):
+            value = request.get(name)
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value <= 0):
+                return 400, {"error": name + " must be a positive integer"}
+            limits.append(value)
+        limits = tuple(limits)
+        position = ResultCache.positionKey(gs)
+        result = self.cache.lookup(position, limits, limits[0])
+        if result is not None:
+            return 200, result
+
+        if self.pending >= self.maxQueue:
+            return 503, {"error": "busy, try again later"}
+        self.pending += 1
+        try:
+            return 200, await asyncio.wait_for(asyncio.shield(self.getSearch(position, fen, limits)), self.timeout)
+        except asyncio.TimeoutError:
+            return 504, {"error": "timed out"}
+        except Exception:  # raised by the search in the worker, or a broken pool
+            return 500, {"error": "search failed"}
+        finally:
+            self.pending -= 1
+
+    '''
+    The task searching the position under limits, started unless an identical request already started it. A request
+    that times out doesn't cancel the task, the others may still be waiting for it.
+    '''
+    def getSearch(self, position, fen, limits):
+        key = (position, limits)
+        if key not in self.inFlight:
+            task = asyncio.ensure_future(self.runSearch(fen, *limits))
+            task.add_done_callback(lambda task: self.finishSearch(key, task))
+            self.inFlight[key] = task
+        return self.inFlight[key]
+
+    '''
+    Cache the result of a search that finished at least one iteration. A search out of time before that answered with
+    a random move, which must not be given again. A request with a depth is cached under the depth it reached, which is
+    less than it asked for when the server timeout stopped it, like ResultCache.searchPosition does.
+    '''
+    def finishSearch(self, key, task):
+        del self.inFlight[key]
+        if not task.cancelled() and task.exception() is None:
+            result = task.result()
+            if result.get("depth", 0) > 0:
+                position, limits = key
+                if limits[0] is not None:
+                    limits = (result["depth"], None, None)
+                self.cache.store(position, limits, result["depth"], result)
+
+    async def runSearch(self, fen, depth, movetime, nodes):
+        started = time.monotonic()
+        async with self.slots: # at most one search per worker, the others wait here
+            timeLeft = self.timeout - (time.monotonic() - started) - RESULT_MARGIN
+            if timeLeft <= 0:
+                raise asyncio.TimeoutError()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.pool, analyse, fen, depth, movetime, nodes, timeLeft)
+
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+               500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+async def serve(host, port, workers, maxQueue, timeout):
+    server = AnalysisServer(workers, maxQueue, timeout)
+    try:
+        tcpServer = await server.start(host, port)
+        print("serving on http://%s:%d" % (host, port))
+        async with tcpServer:
+            await tcpServer.serve_forever()
+    finally:
+        server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP/JSON chess analysis server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--queue", type=int, default=64, help="most requests waiting or running at once")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds per request")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.queue, args.timeout))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Batch analysis of EPD or FEN positions, one per line, read from stdin and answered on stdout as NDJSON (one JSON
+object per line). The searches run in a pool of engine worker processes and only a few positions per worker are read
+ahead, so memory stays bounded however long the input is.
+
+    chess-batch --movetime 500 --checkpoint run.ckpt < positions.epd > results.ndjson
+
+Every result has the "line" number of its position in the input, counting from 0. With --checkpoint the number of
+input lines fully answered is saved as the run goes, and a new run with the same file skips them. Results written
+after the last save are repeated on resume, so drop duplicate line numbers when joining the outputs.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import sys
+
+from . import AnalysisServer
+
+READ_AHEAD = 4  # positions waiting or running per worker
+CHECKPOINT_EVERY = 100  # results
+
+
+'''
+Split an EPD or FEN line into (fen, id). EPD lines have 4 position fields followed by operations such as
+'bm Nf3; id "test 1";' where FEN lines have the halfmove clock and move number.
+'''
+def parsePosition(line):
+    fields = line.split()
+    if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit():
+        return " ".join(fields[:6]), None
+    positionId = None
+    for operation in " ".join(fields[4:]).split(";"):
+        opcode, _, operand = operation.strip().partition(" ")
+        if opcode == "id":
+            positionId = operand.strip().strip('"')
+    return " ".join(fields[:4]), positionId
+
+
+'''
+Runs in a worker process
+'''
+def analysePosition(line, depth, movetime, nodes):
+    fen, positionId = parsePosition(line)
+    timeLimit = float("inf") if movetime is None else movetime / 1000
+    try:
+        result = AnalysisServer.analyse(fen, depth, movetime, nodes, timeLimit)
+    except (ValueError, IndexError, KeyError):
+        result = {"error": "bad position"}
+    result["fen"] = fen
+    if positionId is not None:
+        result["id"] = positionId
+    return result
+
+
+'''
+(line number, text) of the positions in the input from line number offset on, skipping blank lines and # comments
+'''
+def readPositions(stream, offset):
+    for lineNumber, line in enumerate(stream):
+        if lineNumber < offset:
+            continue
+        line = line.strip()
+        if line != "" and not line.startswith("#"):
+            yield lineNumber, line
+
+
+def readCheckpoint(path):
+    if path is None or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return int(f.read())
+
+
+def writeCheckpoint(path, offset):
+    temporaryPath = path + ".tmp"
+    with open(temporaryPath, "w") as f:
+        f.write(str(offset))
+    os.replace(temporaryPath, path)  # a crash never leaves half a checkpoint
+
+
+'''
+Answer every position, ordered as in the input or as the searches finish. positions are (line number, text) pairs
+starting at input line offset. With a checkpoint path, the number of input lines answered is saved as it goes.
+'''
+def analyseBatch(positions, output, pool, limits, workers, ordered=True, checkpoint=None, offset=0):
+    readAhead = workers * READ_AHEAD
+    pending = collections.OrderedDict()  # future -> line number, in input order
+    nextLine = offset  # input line after the last position read
+    sinceCheckpoint = 0
+    positions = iter(positions)
+    while True:
+        for lineNumber, line in itertools.islice(positions, readAhead - len(pending)):
+            pending[pool.submit(analysePosition, line, *limits)] = lineNumber
+            nextLine = lineNumber + 1
+        if len(pending) == 0:
+            break
+        if ordered:
+            done = [next(iter(pending))]
+            done[0].result()  # wait for the oldest position
+        else:
+            done = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)[0]
+        for future in done:
+            result = future.result()
+            result["line"] = pending.pop(future)
+            output.write(json.dumps(result) + "\n")
+            sinceCheckpoint += 1
+        if checkpoint is not None and sinceCheckpoint >= CHECKPOINT_EVERY:
+            output.flush()  # the checkpoint must never get ahead of the output
+            # every line before the oldest position still running is answered
+            writeCheckpoint(checkpoint, next(iter(pending.values()), nextLine))
+            sinceCheckpoint = 0
+    output.flush()
+    if checkpoint is not None:
+        writeCheckpoint(checkpoint, nextLine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="analyse EPD/FEN positions from stdin, write NDJSON to stdout")
+    parser.add_argument("--depth", type=int)
+    parser.add_argument("--movetime", type=int, help="milliseconds per position")
+    parser.add_argument("--nodes", type=int, help="nodes per position")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--unordered", action="store_true", help="write results as they finish, not in input order")
+    parser.add_argument("--checkpoint", help="file saving the number of input lines answered, to resume from")
+    parser.add_argument("--offset", type=int, help="input line to start from, instead of the checkpoint")
+    args = parser.parse_args()
+
+    offset = args.offset if args.offset is not None else readCheckpoint(args.checkpoint)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers,
+                                                initializer=AnalysisServer.initWorker) as pool:
+        analyseBatch(readPositions(sys.stdin, offset), sys.stdout, pool, (args.depth, args.movetime, args.nodes),
+                     args.workers, not args.unordered, args.checkpoint, offset)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,11 @@ This class is responsible for storing all the information about current state of
 responsible for determining valid moves at the current state. It will also keep a move log.
 """
 
+from . import Zobrist
+
+seePieceValue = {"p": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 100} # piece values for static exchange evaluation
+MAX_PLIES = 300 # games between engines this long are drawn, see GameState.getResult
+
 
 class GameState():
     def __init__(self):
@@ -36,11 +41,88 @@ class GameState():
         self.currentCastingRight = CastleRights(True, True, True, True)
         self.castleRightsLog = [CastleRights(self.currentCastingRight.wks, self.currentCastingRight.bks, 
                                              self.currentCastingRight.wqs, self.currentCastingRight.bqs)]
+        self.pawnKey = self.computePawnKey() # zobrist key of the pawns only, for the pawn hash table
+        self.pawnKeyLog = [self.pawnKey]
+        self.zobristKey = Zobrist.polyglotHash(self) # zobrist key of the whole position
+        self.zobristKeyLog = [self.zobristKey] # keys of every position of the game, for repetitions
+        self.halfmoveClock = 0 # moves since the last pawn move or capture, for the fifty move rule
+        self.halfmoveClockLog = [self.halfmoveClock]
+
+    '''
+    Set up the position of a FEN string, e.g. "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1".
+    The move log starts over. Raises ValueError for a bad FEN, a side without exactly one king or pawns on the first
+    or last rank, which the move generation can't handle.
+    '''
+    def loadFEN(self, fen):
+        fields = fen.split()
+        rows = fields[0].split('/') if len(fields) >= 2 else []
+        if len(rows) != 8:
+            raise ValueError("bad FEN: " + fen)
+        board = []
+        for row in rows:
+            boardRow = []
+            for ch in row:
+                if ch.isdigit():
+                    boardRow.extend(["--"] * int(ch))
+                elif ch.lower() in "prnbqk":
+                    color = 'w' if ch.isupper() else 'b'
+                    boardRow.append(color + ('p' if ch.lower() == 'p' else ch.upper()))
+                else:
+                    raise ValueError("bad FEN: " + fen)
+            if len(boardRow) != 8:
+                raise ValueError("bad FEN: " + fen)
+            board.append(boardRow)
+        squares = [square for row in board for square in row]
+        if squares.count("wK") != 1 or squares.count("bK") != 1:
+            raise ValueError("bad FEN, each side needs one king: " + fen)
+        if "wp" in board[0] + board[7] or "bp" in board[0] + board[7]:
+            raise ValueError("bad FEN, pawn on the first or last rank: " + fen)
+        if fields[1] not in ("w", "b"):
+            raise ValueError("bad FEN, side to move must be w or b: " + fen)
+        self.board = board
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] == "wK":
+                    self.whiteKingLocation = (r, c)
+                elif board[r][c] == "bK":
+                    self.blackKingLocation = (r, c)
+        self.whiteToMove = fields[1] == 'w'
+        castling = fields[2] if len(fields) > 2 else "-"
+        self.currentCastingRight = CastleRights('K' in castling, 'k' in castling, 'Q' in castling, 'q' in castling)
+        enpassant = fields[3] if len(fields) > 3 else "-"
+        if enpassant == "-":
+            self.enpassantPossible = ()
+        else:
+            self.enpassantPossible = (Move.ranksToRows[enpassant[1]], Move.filesToCols[enpassant[0]])
+        self.halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+
+        self.moveLog = []
+        self.checkmate = False
+        self.stalemate = False
+        self.enpassantPossibleLog = [self.enpassantPossible]
+        self.castleRightsLog = [CastleRights(self.currentCastingRight.wks, self.currentCastingRight.bks,
+                                             self.currentCastingRight.wqs, self.currentCastingRight.bqs)]
+        self.pawnKey = self.computePawnKey()
+        self.pawnKeyLog = [self.pawnKey]
+        self.zobristKey = Zobrist.polyglotHash(self)
+        self.zobristKeyLog = [self.zobristKey]
+        self.halfmoveClockLog = [self.halfmoveClock]
+
+    def computePawnKey(self):
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c][1] == 'p':
+                    key ^= Zobrist.pieceKey(self.board[r][c], r, c)
+        return key
 
     '''
     move a piece using move parameter. this will not work for pawn promotion, castling, en-passant
     '''
     def makeMove(self, move):
+        # the parts of the key that can't be updated piece by piece
+        oldKeys = Zobrist.castleKey(self.currentCastingRight) ^ \
+                  Zobrist.enpassantKey(self.board, self.enpassantPossible, self.whiteToMove)
         self.board[move.startRow][move.startCol] = "--"  # make blank in source
         self.board[move.endRow][move.endCol] = move.pieceMoved  # put piece in destination
         self.moveLog.append(move)  # log the move, so we can see history or undo move
@@ -77,11 +159,45 @@ class GameState():
 
         self.enpassantPossibleLog.append(self.enpassantPossible)
 
+        # update the pawn key - pawn moves, pawn captures and promotions
+        if move.pieceMoved[1] == 'p':
+            self.pawnKey ^= Zobrist.pieceKey(move.pieceMoved, move.startRow, move.startCol)
+            if not move.isPawnPromotion:
+                self.pawnKey ^= Zobrist.pieceKey(move.pieceMoved, move.endRow, move.endCol)
+        if move.pieceCaptured[1] == 'p':
+            captureRow = move.startRow if move.isEnpassantMove else move.endRow
+            self.pawnKey ^= Zobrist.pieceKey(move.pieceCaptured, captureRow, move.endCol)
+        self.pawnKeyLog.append(self.pawnKey)
+
         # update castling rights - whenever it is a rock or a king move
         self.updateCastleRights(move)
         self.castleRightsLog.append(CastleRights(self.currentCastingRight.wks, self.currentCastingRight.bks, 
                                              self.currentCastingRight.wqs, self.currentCastingRight.bqs))
 
+        # update the zobrist key
+        key = self.zobristKey ^ oldKeys ^ Zobrist.POLYGLOT_RANDOM_ARRAY[Zobrist.TURN]
+        key ^= Zobrist.pieceKey(move.pieceMoved, move.startRow, move.startCol)
+        key ^= Zobrist.pieceKey(self.board[move.endRow][move.endCol], move.endRow, move.endCol)
+        if move.pieceCaptured != "--":
+            captureRow = move.startRow if move.isEnpassantMove else move.endRow
+            key ^= Zobrist.pieceKey(move.pieceCaptured, captureRow, move.endCol)
+        if move.isCastleMove:
+            rookCol = move.endCol-1 if move.endCol - move.startCol == 2 else move.endCol+1
+            oldRookCol = move.endCol+1 if move.endCol - move.startCol == 2 else move.endCol-2
+            rook = self.board[move.endRow][rookCol]
+            if rook != "--":
+                key ^= Zobrist.pieceKey(rook, move.endRow, oldRookCol) ^ Zobrist.pieceKey(rook, move.endRow, rookCol)
+        key ^= Zobrist.castleKey(self.currentCastingRight)
+        key ^= Zobrist.enpassantKey(self.board, self.enpassantPossible, self.whiteToMove)
+        self.zobristKey = key
+        self.zobristKeyLog.append(key)
+
+        if move.pieceMoved[1] == 'p' or move.pieceCaptured != "--":
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        self.halfmoveClockLog.append(self.halfmoveClock)
+
 
     '''
       undo the last move
@@ -112,6 +228,13 @@ class GameState():
             self.enpassantPossibleLog.pop()
             self.enpassantPossible = self.enpassantPossibleLog[-1]
 
+            self.pawnKeyLog.pop()
+            self.pawnKey = self.pawnKeyLog[-1]
+            self.zobristKeyLog.pop()
+            self.zobristKey = self.zobristKeyLog[-1]
+            self.halfmoveClockLog.pop()
+            self.halfmoveClock = self.halfmoveClockLog[-1]
+
             # undo castling rights
             self.castleRightsLog.pop() #get rid of the new castle rights from the move we are undoing
             newRights = self.castleRightsLog[-1]
@@ -130,6 +253,38 @@ class GameState():
             self.checkmate = False
             self.stalemate = False
     
+    """
+    True if the current position occurred before. Only positions with the same side to move since the last pawn move
+    or capture can repeat, so only those halfmoveClock keys are looked at.
+    """
+    def isRepetition(self):
+        last = len(self.zobristKeyLog) - 1
+        for i in range(last - 2, max(last - self.halfmoveClock, 0) - 1, -2):
+            if self.zobristKeyLog[i] == self.zobristKey:
+                return True
+        return False
+
+    def isFiftyMoveDraw(self):
+        return self.halfmoveClock >= 100
+
+    """
+    (result, reason) once the game is over, else None. result is "1-0", "0-1" or "1/2-1/2", reason one of checkmate,
+    stalemate, fifty moves, repetition (threefold) and move limit, when maxPlies plies were played. Call it after
+    getValidMoves, which finds checkmate and stalemate.
+    """
+    def getResult(self, maxPlies=None):
+        if self.checkmate:
+            return ("0-1" if self.whiteToMove else "1-0"), "checkmate"
+        if self.stalemate:
+            return "1/2-1/2", "stalemate"
+        if self.isFiftyMoveDraw():
+            return "1/2-1/2", "fifty moves"
+        if self.zobristKeyLog.count(self.zobristKey) >= 3:
+            return "1/2-1/2", "repetition"
+        if maxPlies is not None and len(self.moveLog) >= maxPlies:
+            return "1/2-1/2", "move limit"
+        return None
+
     """
     Update the castle rights given the move
     """
@@ -236,7 +391,7 @@ class GameState():
                 moves.append(Move((r, c), (r - 1, c), self.board))
 
                 # 2 square pawn advance
-                if (self.board[r - 2][c] == "--") and (r == 6):
+                if (r == 6) and (self.board[r - 2][c] == "--"):
                     moves.append(Move((r, c), (r - 2, c), self.board))
 
             # capture left corner
@@ -258,7 +413,7 @@ class GameState():
                 moves.append(Move((r, c), (r + 1, c), self.board))
 
                 # 2 square pawn advance
-                if (self.board[r + 2][c] == "--") and (r == 1):
+                if (r == 1) and (self.board[r + 2][c] == "--"):
                     moves.append(Move((r, c), (r + 2, c), self.board))
 
             # capture left corner
@@ -371,6 +526,62 @@ class GameState():
         self.getBishopMoves(r, c, moves)
         self.getRookeMoves(r, c, moves)
 
+    """
+    All pieces of color that attack square r,c as (value, row, col). Pieces on the squares in removed are treated as
+    gone, so sliders behind them are seen (x-rays).
+    """
+    def getAttackers(self, r, c, color, removed=()):
+        attackers = []
+        pawnRow = r + 1 if color == 'w' else r - 1
+        for endRow, endCol in ((pawnRow, c - 1), (pawnRow, c + 1)):
+            if 0 <= endRow < 8 and 0 <= endCol < 8 and self.board[endRow][endCol] == color + 'p' \
+                    and (endRow, endCol) not in removed:
+                attackers.append((seePieceValue['p'], endRow, endCol))
+        for directions, pieceType in ((((2, -1), (2, 1), (-2, 1), (-2, -1), (1, -2), (1, 2), (-1, -2), (-1, 2)), 'N'),
+                                      (((0, -1), (0, 1), (1, 0), (-1, 0), (-1, -1), (1, 1), (1, -1), (-1, 1)), 'K')):
+            for d in directions:
+                endRow, endCol = r + d[0], c + d[1]
+                if 0 <= endRow < 8 and 0 <= endCol < 8 and self.board[endRow][endCol] == color + pieceType \
+                        and (endRow, endCol) not in removed:
+                    attackers.append((seePieceValue[pieceType], endRow, endCol))
+        for directions, sliders in ((((-1, 0), (0, -1), (1, 0), (0, 1)), 'RQ'), (((-1, -1), (-1, 1), (1, -1), (1, 1)), 'BQ')):
+            for d in directions:
+                for i in range(1, 8):
+                    endRow, endCol = r + d[0] * i, c + d[1] * i
+                    if not (0 <= endRow < 8 and 0 <= endCol < 8):
+                        break
+                    endPiece = self.board[endRow][endCol]
+                    if endPiece == "--" or (endRow, endCol) in removed:
+                        continue
+                    if endPiece[0] == color and endPiece[1] in sliders:
+                        attackers.append((seePieceValue[endPiece[1]], endRow, endCol))
+                    break
+        return attackers
+
+    """
+    Static exchange evaluation. The material the side making the move wins if both sides keep recapturing on the
+    target square with their least valuable attacker, and either side may stop. No move is made on the board.
+    """
+    def see(self, move):
+        r, c = move.endRow, move.endCol
+        removed = {(move.startRow, move.startCol)}
+        gain = [seePieceValue[move.pieceCaptured[1]] if move.pieceCaptured != "--" else 0]
+        onSquare = seePieceValue['Q' if move.isPawnPromotion else move.pieceMoved[1]]
+        color = 'b' if move.pieceMoved[0] == 'w' else 'w'
+        while True:
+            attackers = self.getAttackers(r, c, color, removed)
+            if len(attackers) == 0:
+                break
+            value, attackerRow, attackerCol = min(attackers)
+            gain.append(onSquare - gain[-1])
+            onSquare = value
+            removed.add((attackerRow, attackerCol))
+            color = 'b' if color == 'w' else 'w'
+        while len(gain) > 1: # a side only recaptures when it doesn't lose by it
+            last = gain.pop()
+            gain[-1] = -max(-gain[-1], last)
+        return gain[0]
+
 
 
 
@@ -423,5 +634,9 @@ class Move():
     def getChessNotation(self):
         return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
 
+    # coordinate notation with the promotion piece, as used by UCI. example : e7e8q
+    def getUciNotation(self):
+        return self.getChessNotation() + ('q' if self.isPawnPromotion else '')
+
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
@@ -2,17 +2,32 @@
 This is our main driver file. It will be responsible for holding user input and display the current GameState Object
 """
 
-import pygame as p
+import argparse
+import copy
+import datetime
+import os
+import threading
 
-
-import ChessEngine, SmartMoveFinder
-# from Chess import ChessEngine
+from . import ChessEngine, Pgn, ResultCache, SmartMoveFinder
 
 WIDTH = HEIGHT = 512
 DIMENSION = 8  # dimension of chess board
 SQ_SIZE = HEIGHT // DIMENSION
-MAX_FPS = 15  # for animation
+MAX_FPS = 15  # while the AI thinks
+ANIMATION_FPS = 60
+ANIMATION_TIME = 200  # ms a move animation takes, however far the piece goes
+IDLE_TIMEOUT = 500  # ms to sleep waiting for an event when there is nothing to do
 IMAGES = {}
+IMAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images")
+LIGHT_COLOR = (235, 236, 208) # beige
+DARK_COLOR = (115, 149, 82) # light gray
+boardSurface = None # the empty board, drawn once. see getBoardSurface
+FONT_NAME = "Helvitca"
+TEXT_CACHE_SIZE = 256 # rendered texts kept
+fonts = {} # size -> font
+textSurfaces = {} # (text, color, size) -> rendered text
+resultCache = ResultCache.ResultCache()  # the AI replays positions it has searched before, e.g. after a reset
+p = None # pygame, only imported by main() when it opens the window, so --headless runs without it
 
 '''
 Initialise a global dictionary of images. This will be called exactly once in the main.
@@ -23,7 +38,7 @@ def loadImages():
     pieces = ["bR", "bN", "bB", "bQ", "bK", "bp", "wR", "wN", "wB", "wQ", "wK", "wp"]
     for piece in pieces:
         # images loading with scaling
-        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
+        IMAGES[piece] = p.transform.scale(p.image.load(os.path.join(IMAGE_PATH, piece + ".png")), (SQ_SIZE, SQ_SIZE))
 
     # Note: we can access an image by saying 'IMAGES['WP']'
 
@@ -34,6 +49,12 @@ The main driver of our code. This will handle user input and updating the graphi
 
 
 def main():
+    global p
+    args = parseArguments()
+    if args.headless:
+        playHeadless(args.games, args.depth, args.pgn)
+        return
+    import pygame as p
     p.init()
     p.display.set_caption("Chess with AI")
     screen = p.display.set_mode((WIDTH, HEIGHT))
@@ -42,6 +63,7 @@ def main():
     gs = ChessEngine.GameState()
 
     validMoves = gs.getValidMoves()
+    movesFrom, movesByID = indexMoves(validMoves)
     moveMade = False    # flag variable for when a move is made
     animate = False # flag variable for when we should animate a move 
     loadImages()  # only do this once. before the while loop
@@ -52,11 +74,25 @@ def main():
     gameOver = False
     playerOne = False #If a Human is playing white, then this will be true.
     playerTwo = False #Same as above but for black
+    aiThinking = False # the AI searches on moveFinderThread, so the window keeps handling events
+    moveFinderThread = None
+    aiStopEvent = None # set to stop the search of moveFinderThread, its own so no other search clears it
+    aiResult = [] # the move finder thread appends the AI move here
+    fullRedraw = True # redraw the whole window on the next frame
+    dirtySquares = set() # else only redraw these squares
+    highlighted = set() # squares highlighted on the screen
+    gameOverShown = False # the game over text is on the screen
+    animation = None # (move, start time in ms, rect the piece was last drawn at) of the move being animated
     
     while running:  # game started
         humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
-        for event in p.event.get():
+        # frames are only timed while the AI has a move to find, else sleep until something happens
+        busy = aiThinking or animation is not None or (not gameOver and not humanTurn)
+        for event in (p.event.get() if busy else waitForEvents()):
             if event.type == p.QUIT:  # cross clicked
+                SmartMoveFinder.stopPonder()
+                if aiThinking:
+                    stopMoveFinder(moveFinderThread, aiStopEvent)
                 running = False  # quit game
 
             # mouse click
@@ -78,95 +114,219 @@ def main():
                         move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board)
                         print(move.getChessNotation())
 
-                        for i in range(len(validMoves)):
-                            if move == validMoves[i]:
-                                # print(move.pieceMoved)
-                                gs.makeMove(validMoves[i])
-                                moveMade = True
-                                animate = True
-                                sqSelected = ()
-                                playerClicks = []
-                                txtMove = "White's turn" if gs.whiteToMove else "Black's turn"
-                                print(txtMove)
+                        if move.moveID in movesByID:
+                            gs.makeMove(movesByID[move.moveID])
+                            moveMade = True
+                            animate = True
+                            sqSelected = ()
+                            playerClicks = []
+                            txtMove = "White's turn" if gs.whiteToMove else "Black's turn"
+                            print(txtMove)
                         if not moveMade:
                             playerClicks = [sqSelected]
 
             # undo move
             elif event.type == p.KEYDOWN:
                 if event.key == p.K_z:  # undo when z is pressed
+                    SmartMoveFinder.stopPonder()
+                    if aiThinking:
+                        stopMoveFinder(moveFinderThread, aiStopEvent)
+                        aiThinking = False
+                    if len(gs.moveLog) > 0:
+                        dirtySquares.update(moveSquares(gs.moveLog[-1]))
+                    if animation is not None: # cut it short
+                        dirtySquares.update(squaresUnder(animation[2]))
+                        animation = None
                     gs.undoMove()
                     moveMade = True
                     animate = False
                     gameOver = False
                 if event.key == p.K_r: #reset the board when 'r' is pressed
+                    SmartMoveFinder.stopPonder()
+                    if aiThinking:
+                        stopMoveFinder(moveFinderThread, aiStopEvent)
+                        aiThinking = False
+                    SmartMoveFinder.newGame()
                     gs = ChessEngine.GameState()
                     validMoves = gs.getValidMoves()
+                    movesFrom, movesByID = indexMoves(validMoves)
                     sqSelected = ()
                     playerClicks = []
                     moveMade = False
                     animate = False
                     gameOver = False
+                    fullRedraw = True
+                    animation = None
 
         # AI move finder
         if not gameOver and not humanTurn:
-            AIMove = SmartMoveFinder.findBestMove(gs, validMoves)
-            if AIMove is None:
-                AIMove = SmartMoveFinder.findRandomMove(validMoves)
-            gs.makeMove(AIMove)
-            moveMade = True
-            animate = True
+            if not aiThinking:
+                aiThinking = True
+                aiResult = []
+                pondering = SmartMoveFinder.ponderHit(gs) # take over the ponder search if the human played as predicted
+                ponderThread, aiStopEvent = pondering if pondering is not None else (None, threading.Event())
+                moveFinderThread = threading.Thread(target=findAIMove,
+                                                    args=(copy.deepcopy(gs), aiResult, aiStopEvent, ponderThread),
+                                                    daemon=True)
+                moveFinderThread.start()
+            elif not moveFinderThread.is_alive():
+                aiThinking = False
+                AIMove = None
+                if len(aiResult) > 0 and aiResult[0] is not None: # the thread searched a copy, find the same move in our list
+                    AIMove = movesByID.get(aiResult[0].moveID)
+                if AIMove is None:
+                    AIMove = SmartMoveFinder.findRandomMove(validMoves)
+                gs.makeMove(AIMove)
+                moveMade = True
+                animate = True
+                if (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo):
+                    SmartMoveFinder.startPonder(gs) # keep searching while the human thinks
 
 
         if moveMade:
-            if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)
+            if animation is not None: # a new move cuts the last animation short
+                dirtySquares.update(squaresUnder(animation[2]))
+                animation = None
+            if len(gs.moveLog) > 0:
+                dirtySquares.update(moveSquares(gs.moveLog[-1]))
+                if animate:
+                    move = gs.moveLog[-1]
+                    animation = (move, p.time.get_ticks(), p.Rect(move.startCol * SQ_SIZE, move.startRow * SQ_SIZE,
+                                                                  SQ_SIZE, SQ_SIZE))
             validMoves = gs.getValidMoves()
+            movesFrom, movesByID = indexMoves(validMoves)
             moveMade = False
             animate = False
 
-        drawGameState(screen, gs, validMoves, sqSelected)
-
-        if gs.checkmate:
-            gameOver = True
-            if gs.whiteToMove:
-                drawText(screen, 'Checkmate! Black wins.')
-            else:
-                drawText(screen, 'Checkmate! White wins.')
-        elif gs.stalemate:
-            gameOver = True
-            drawText(screen, 'Stalemate!')
+        gameOver = gs.checkmate or gs.stalemate
+        if gameOver != gameOverShown:
+            fullRedraw = True # put up or take down the game over text
+            gameOverShown = gameOver
+
+        newHighlighted = getHighlightedSquares(gs, movesFrom, sqSelected)
+        if newHighlighted != highlighted:
+            dirtySquares.update(highlighted | newHighlighted)
+            highlighted = newHighlighted
+
+        if animation is not None and p.time.get_ticks() - animation[1] >= ANIMATION_TIME: # done
+            # the last frame may have been short of the end square, which every frame blanked
+            dirtySquares.update(squaresUnder(animation[2]))
+            dirtySquares.update(moveSquares(animation[0]))
+            animation = None
+
+        rects = []
+        if fullRedraw:
+            drawGameState(screen, gs, movesFrom, sqSelected)
+        elif len(dirtySquares) > 0:
+            rects = drawSquares(screen, gs, highlighted, dirtySquares)
+        if animation is not None:
+            move, startTicks, lastRect = animation
+            animationRects, pieceRect = drawAnimation(screen, gs, highlighted, move,
+                                                      (p.time.get_ticks() - startTicks) / ANIMATION_TIME, lastRect)
+            rects.extend(animationRects)
+            animation = (move, startTicks, pieceRect)
+        if gameOver and (fullRedraw or len(rects) > 0): # the text is drawn over the squares
+            rects.append(drawText(screen, getGameOverText(gs)))
+        if fullRedraw:
+            p.display.flip()
+        elif len(rects) > 0:
+            p.display.update(rects)
+        fullRedraw = False
+        dirtySquares = set()
 
         # UI
-        clock.tick(MAX_FPS)
-        p.display.flip()
+        if animation is not None:
+            clock.tick(ANIMATION_FPS)
+        elif aiThinking:
+            clock.tick(MAX_FPS)
+
+
+'''
+Block until there is an event, or IDLE_TIMEOUT passed, and return all the events waiting
+'''
+def waitForEvents():
+    event = p.event.wait(IDLE_TIMEOUT)
+    if event.type == p.NOEVENT:
+        return []
+    return [event] + p.event.get()
+
+'''
+Runs on the move finder thread, on a copy of the game so the board on screen doesn't change during the search.
+Appends the AI move, or None when the search was stopped before it found one. ponderThread is the ponder search
+handed over by SmartMoveFinder.ponderHit, searching this position already; its move is used when it finds one.
+'''
+def findAIMove(gs, result, stopEvent, ponderThread=None):
+    validMoves = gs.getValidMoves()
+    AIMove = None
+    if ponderThread is not None:
+        AIMove = SmartMoveFinder.waitPonder(ponderThread, validMoves)
+    if AIMove is None:
+        AIMove = resultCache.findBestMove(gs, validMoves, stopEvent=stopEvent)
+    result.append(AIMove)
+
+
+'''
+Stop the search of the move finder thread, for undo, reset and quit
+'''
+def stopMoveFinder(moveFinderThread, stopEvent):
+    stopEvent.set()
+    moveFinderThread.join()
+
 
 '''
 Highlight square selected and move for piece selected
 '''
 
-def highlightSquares(screen, gs, validMoves, sqSelected):
+def highlightSquares(screen, gs, movesFrom, sqSelected):
+    for r, c in getHighlightedSquares(gs, movesFrom, sqSelected):
+        screen.blit(getHighlightSurface(), (c*SQ_SIZE, r*SQ_SIZE))
+
+
+'''
+The selected square and the squares its piece can move to, when it is a piece of the side to move
+'''
+def getHighlightedSquares(gs, movesFrom, sqSelected):
+    squares = set()
     if sqSelected != ():
         r, c = sqSelected
         if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'): #sqSelected is a piece that can be moved
-            # highlight selected square
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100) # transparency value -> 0 transparent; 255 opaque
-            s.fill(p.Color('yellow'))
-            screen.blit(s, (c*SQ_SIZE, r*SQ_SIZE))
-            #highlight moves from that square
-            s.fill(p.Color('yellow'))
-            for move in validMoves:
-                if move.startRow == r and move.startCol == c:
-                    screen.blit(s, (move.endCol * SQ_SIZE, move.endRow * SQ_SIZE))
+            squares.add((r, c))
+            for move in movesFrom.get((r, c), ()):
+                squares.add((move.endRow, move.endCol))
+    return squares
+
+
+'''
+Index the valid moves by start square, (row, col) -> moves, and by moveID -> move. Build it every time the valid
+moves change, so clicks and highlights don't search the list.
+'''
+def indexMoves(validMoves):
+    movesFrom = {}
+    movesByID = {}
+    for move in validMoves:
+        movesFrom.setdefault((move.startRow, move.startCol), []).append(move)
+        movesByID[move.moveID] = move
+    return movesFrom, movesByID
+
+
+highlightSurface = None
+
+def getHighlightSurface():
+    global highlightSurface
+    if highlightSurface is None:
+        highlightSurface = p.Surface((SQ_SIZE, SQ_SIZE))
+        highlightSurface.set_alpha(100) # transparency value -> 0 transparent; 255 opaque
+        highlightSurface.fill(p.Color('yellow'))
+    return highlightSurface
 
 
 '''
 Responsible for all the graphics within a current game state
 '''
 
-def drawGameState(screen, gs, validMoves, sqSelected):
+def drawGameState(screen, gs, movesFrom, sqSelected):
     drawBoard(screen)  # draw square on boards
-    highlightSquares(screen, gs, validMoves, sqSelected)
+    highlightSquares(screen, gs, movesFrom, sqSelected)
     # add in piece highlighting and move suggestions
     drawPieces(screen, gs.board)
 
@@ -175,14 +335,60 @@ def drawGameState(screen, gs, validMoves, sqSelected):
 Draw the squares on the board. The top left corner is always light.
 '''
 def drawBoard(screen):
-    global colors
-    light_gray = (115, 149, 82)
-    beige = (235, 236, 208)
-    colors = [p.Color(beige), p.Color(light_gray)]
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            color = colors[((r + c) % 2)]
-            p.draw.rect(screen, color, p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+    screen.blit(getBoardSurface(), (0, 0))
+
+
+'''
+The squares of the board rendered once into a surface in the display format, so a frame only blits it.
+Needs the display mode to be set.
+'''
+def getBoardSurface():
+    global boardSurface
+    if boardSurface is None:
+        colors = [p.Color(LIGHT_COLOR), p.Color(DARK_COLOR)]
+        boardSurface = p.Surface((DIMENSION * SQ_SIZE, DIMENSION * SQ_SIZE)).convert()
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                color = colors[((r + c) % 2)]
+                p.draw.rect(boardSurface, color, p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+    return boardSurface
+
+
+'''
+Call after changing the square size or the colors, the board is rendered again when next drawn
+'''
+def invalidateBoardSurface():
+    global boardSurface
+    boardSurface = None
+
+
+'''
+Redraw only the given squares: the square, its highlight and its piece. Returns the rects to update on the display.
+'''
+def drawSquares(screen, gs, highlighted, squares):
+    rects = []
+    for r, c in squares:
+        rect = p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        screen.blit(getBoardSurface(), rect, rect)
+        if (r, c) in highlighted:
+            screen.blit(getHighlightSurface(), rect)
+        piece = gs.board[r][c]
+        if piece != "--":
+            screen.blit(IMAGES[piece], rect)
+        rects.append(rect)
+    return rects
+
+
+'''
+The squares a move changes: its start and end, the pawn taken en passant and the rook of a castle
+'''
+def moveSquares(move):
+    squares = [(move.startRow, move.startCol), (move.endRow, move.endCol)]
+    if move.isEnpassantMove:
+        squares.append((move.startRow, move.endCol))
+    if move.isCastleMove:
+        squares.extend([(move.endRow, col) for col in ((5, 7) if move.endCol == 6 else (0, 3))])
+    return squares
 
 
 def drawPieces(screen, board):
@@ -194,34 +400,120 @@ def drawPieces(screen, board):
 
 
 '''
-Animating a move
+Draw a frame of the move animation: the moving piece fraction of the way from its start to its end square, and the
+end square as it was before the move. lastRect is where the piece was drawn in the frame before.
+Returns (rects drawn on, rect of the piece).
 '''
-def animateMove(move, screen, board, clock):
-    global colors
-    dR = move.endRow - move.startRow
-    dC = move.endCol - move.startCol
-    framePerSquare = 10 #frame to move one square
-    frameCount = (abs(dR) + abs(dC)) * framePerSquare
-    for frame in range(frameCount+1):
-        r, c = (move.startRow + dR*frame/frameCount, move.startCol + dC * frame / frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        #erase the piece moved from its ending square
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSquare = p.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect(screen, color, endSquare)
+def drawAnimation(screen, gs, highlighted, move, fraction, lastRect):
+    r = move.startRow + (move.endRow - move.startRow) * fraction
+    c = move.startCol + (move.endCol - move.startCol) * fraction
+    pieceRect = p.Rect(round(c * SQ_SIZE), round(r * SQ_SIZE), SQ_SIZE, SQ_SIZE)
+    rects = drawSquares(screen, gs, highlighted, squaresUnder(lastRect) | squaresUnder(pieceRect))
+    #erase the piece moved from its ending square, put back what it captures
+    endSquare = p.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+    screen.blit(getBoardSurface(), endSquare, endSquare)
+    if move.pieceCaptured != '--' and not move.isEnpassantMove:
+        screen.blit(IMAGES[move.pieceCaptured], endSquare)
+    screen.blit(IMAGES[move.pieceMoved], pieceRect)
+    return rects + [endSquare], pieceRect
 
-        #draw captured piece onto rectangle
-        if move.pieceCaptured != '--':
-            screen.blit(IMAGES[move.pieceMoved], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-            p.display.flip()
-            clock.tick(60)
-    
+
+'''
+The squares a rect on the board overlaps
+'''
+def squaresUnder(rect):
+    squares = set()
+    for r in range(max(rect.top // SQ_SIZE, 0), min((rect.bottom - 1) // SQ_SIZE, DIMENSION - 1) + 1):
+        for c in range(max(rect.left // SQ_SIZE, 0), min((rect.right - 1) // SQ_SIZE, DIMENSION - 1) + 1):
+            squares.add((r, c))
+    return squares
+
+
+def getGameOverText(gs):
+    if gs.checkmate:
+        return 'Checkmate! Black wins.' if gs.whiteToMove else 'Checkmate! White wins.'
+    return 'Stalemate!'
+
+
+'''
+Draw text in the middle of the window. Returns the rect drawn on.
+'''
 def drawText(screen, text):
-    font = p.font.SysFont("Helvitca", 32, True, False)
-    textObject = font.render(text, 0, p.Color('Grey'))
+    textObject = renderText(text, 'Black', 32)
     textLocation = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObject.get_width()/2, HEIGHT/2 - textObject.get_height()/2)
-    textObject = font.render(text, 0, p.Color('Black'))
-    screen.blit(textObject, textLocation.move(2, 2))
+    return screen.blit(textObject, textLocation.move(2, 2))
+
 
-main()
+'''
+The font of that size. SysFont looks the font up on the system every time, so each size is only made once.
+'''
+def getFont(size):
+    if size not in fonts:
+        fonts[size] = p.font.SysFont(FONT_NAME, size, True, False)
+    return fonts[size]
+
+
+'''
+A surface with the text rendered on it, rendered once for each text, color and size. For any text drawn every frame:
+the game over text, move lists, evaluations, clocks.
+'''
+def renderText(text, color, size):
+    key = (text, color, size)
+    if key not in textSurfaces:
+        if len(textSurfaces) >= TEXT_CACHE_SIZE: # e.g. a clock renders a new text every second
+            textSurfaces.clear()
+        textSurfaces[key] = getFont(size).render(text, 0, p.Color(color))
+    return textSurfaces[key]
+
+
+'''
+Command line: with --headless the AI plays itself without a window, as fast as it can
+'''
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Chess with AI")
+    parser.add_argument("--headless", action="store_true", help="AI against AI without a window, for long runs")
+    parser.add_argument("--games", type=int, default=1, help="headless games to play, 0 to play until stopped")
+    parser.add_argument("--depth", type=int, default=SmartMoveFinder.DEPTH, help="search depth of the AI")
+    parser.add_argument("--pgn", default="games.pgn", help="file the headless games are appended to")
+    args = parser.parse_args()
+    if args.depth < 1:
+        parser.error("--depth must be at least 1")
+    return args
+
+
+'''
+Play AI against AI games back to back without pygame, appending each game to pgnPath as soon as it ends
+'''
+def playHeadless(games, depth, pgnPath):
+    gameNumber = 0
+    while games == 0 or gameNumber < games:
+        gameNumber += 1
+        SmartMoveFinder.newGame()
+        gs = ChessEngine.GameState()
+        result, reason = playHeadlessGame(gs, depth)
+        headers = {"Event": "Headless AI vs AI", "Date": datetime.date.today().strftime("%Y.%m.%d"),
+                   "Round": str(gameNumber), "White": "AI", "Black": "AI", "Result": result, "Termination": reason}
+        with open(pgnPath, "a") as f:
+            Pgn.writeGame(f, gs.moveLog, headers)
+        print("game %d: %s %s after %d moves" % (gameNumber, result, reason, (len(gs.moveLog) + 1) // 2))
+
+
+'''
+Returns (result, reason) once the game is over
+'''
+def playHeadlessGame(gs, depth):
+    while True:
+        validMoves = gs.getValidMoves()
+        gameResult = gs.getResult(ChessEngine.MAX_PLIES)
+        if gameResult is not None:
+            return gameResult
+        AIMove = SmartMoveFinder.findBookMove(gs, validMoves)
+        if AIMove is None:
+            AIMove = SmartMoveFinder.searchPosition(gs, validMoves, depth)[0]
+        if AIMove is None:
+            AIMove = SmartMoveFinder.findRandomMove(validMoves)
+        gs.makeMove(AIMove)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Opening book in the Polyglot .bin format. The book file is memory mapped and never read into memory. Every entry is
+16 bytes (key, move, weight, learn) and the entries are sorted by key, so a position is found with a binary search.
+"""
+
+import mmap
+import os
+import random
+import struct
+
+ENTRY = struct.Struct(">QHHI")  # key, move, weight, learn. all big endian
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin")
+
+
+class PolyglotBook():
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size // ENTRY.size
+        # mmap can't map an empty file
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size > 0 else None
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+        self.file.close()
+
+    def keyAt(self, i):
+        return ENTRY.unpack_from(self.data, i * ENTRY.size)[0]
+
+    '''
+    All (move, weight) pairs stored for the key. Binary search for the first entry, then read while the key matches.
+    '''
+    def getEntries(self, key):
+        low, high = 0, self.size
+        while low < high:
+            mid = (low + high) // 2
+            if self.keyAt(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        entries = []
+        for i in range(low, self.size):
+            entryKey, rawMove, weight, learn = ENTRY.unpack_from(self.data, i * ENTRY.size)
+            if entryKey != key:
+                break
+            entries.append((rawMove, weight))
+        return entries
+
+    '''
+    Pick a book move for the position, weighted by the book weights. Returns None when the position is not in the book.
+    '''
+    def findMove(self, gs, validMoves):
+        candidates = []
+        weights = []
+        for rawMove, weight in self.getEntries(gs.zobristKey):
+            move = decodeMove(rawMove, gs, validMoves)
+            if move is not None and weight > 0:
+                candidates.append(move)
+                weights.append(weight)
+        if len(candidates) == 0:
+            return None
+        return random.choices(candidates, weights)[0]
+
+
+'''
+Polyglot move: bits 0-5 to square, bits 6-11 from square (a1 = 0), bits 12-14 promotion piece.
+Castling is stored as the king capturing its own rook, e.g. e1h1.
+'''
+def decodeMove(rawMove, gs, validMoves):
+    if (rawMove >> 12) & 7 not in (0, 4):  # we only promote to a queen
+        return None
+    endRow = 7 - ((rawMove >> 3) & 7)
+    endCol = rawMove & 7
+    startRow = 7 - ((rawMove >> 9) & 7)
+    startCol = (rawMove >> 6) & 7
+    if gs.board[startRow][startCol][1] == 'K' and startCol == 4 and endCol in (0, 7):
+        endCol = 6 if endCol == 7 else 2
+    moveID = startRow * 1000 + startCol * 100 + endRow * 10 + endCol
+    for move in validMoves:
+        if move.moveID == moveID:
+            return move
+    return None
+
+
+'''
+Open the book at path, or return None if there is no book file
+'''
+def openBook(path=BOOK_PATH):
+    if not os.path.exists(path):
+        return None
+    return PolyglotBook(path)
@@ -0,0 +1,234 @@
+"""
+Reading and writing games in PGN (Portable Game Notation) with moves in SAN (Standard Algebraic Notation), e.g. Nbd7.
+
+readGames(stream) is a generator over a text file. It keeps one game in memory at a time, so it reads PGN files of
+any size. SAN moves are resolved with attack lookups on the board (GameState.getAttackers) rather than by generating
+every valid move, and a move is only tried on the board when a pin could make it ambiguous.
+The engine always promotes to a queen, so games with an underpromotion are skipped.
+"""
+
+import re
+
+from . import ChessEngine
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+LINE_LENGTH = 79  # characters of movetext per line
+
+TOKEN = re.compile(r'[{}();]|[^\s{}();]+')
+TAG = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+MOVE_NUMBER = re.compile(r'^\d+\.*')
+SAN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(?:=?([NBRQ]))?$')
+
+
+'''
+Games in the stream as (headers, gs), gs holding the moves of the game in its move log. headers is a dict of the tags,
+with "Result" set from the termination marker when there was no tag. Comments, variations and NAGs are skipped.
+A game with a move that can't be played raises ValueError, or is left out when skipBadGames.
+'''
+def readGames(stream, skipBadGames=True):
+    headers = {}
+    gs = None
+    badGame = False
+    inComment = False
+    variationDepth = 0
+    for line in stream:
+        if not inComment and variationDepth == 0 and line.startswith("["):
+            match = TAG.match(line)
+            if match is not None:
+                if gs is not None:  # the game before had no termination marker
+                    if not badGame:
+                        yield headers, gs
+                    headers, gs, badGame = {}, None, False
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+                continue
+        if line.startswith("%"):  # escape line
+            continue
+        pos = 0
+        while True:
+            if inComment:
+                end = line.find("}", pos)
+                if end < 0:
+                    break
+                inComment = False
+                pos = end + 1
+            match = TOKEN.search(line, pos)
+            if match is None:
+                break
+            token = match.group()
+            pos = match.end()
+            if token == "{":
+                inComment = True
+            elif token == ";":  # comment to the end of the line
+                break
+            elif token == "(":
+                variationDepth += 1
+            elif token == ")":
+                variationDepth = max(variationDepth - 1, 0)
+            elif variationDepth > 0 or token[0] == "$":
+                continue
+            elif token in RESULTS:
+                if gs is None:
+                    gs = startGame(headers)
+                headers.setdefault("Result", token)
+                if not badGame:
+                    yield headers, gs
+                headers, gs, badGame = {}, None, False
+            else:
+                token = MOVE_NUMBER.sub("", token)  # 12. or 12... or 12.e4
+                if token == "" or badGame:
+                    continue
+                if gs is None:
+                    gs = startGame(headers)
+                try:
+                    gs.makeMove(parseSAN(gs, token))
+                except ValueError:
+                    if not skipBadGames:
+                        raise
+                    badGame = True
+    if gs is not None and not badGame:
+        headers.setdefault("Result", "*")
+        yield headers, gs
+
+
+def startGame(headers):
+    gs = ChessEngine.GameState()
+    if "FEN" in headers:
+        gs.loadFEN(headers["FEN"])
+    return gs
+
+
+'''
+The move of gs written as san, e.g. "Nbd7", "exd6", "O-O-O", "e8=Q+". Raises ValueError when there is no such move.
+Moves are trusted to be legal, only ambiguous ones are checked.
+'''
+def parseSAN(gs, san):
+    color = 'w' if gs.whiteToMove else 'b'
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "O-O-O", "0-0", "0-0-0"):
+        r, c = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
+        if c != 4:
+            raise ValueError("can't castle: " + san)
+        return ChessEngine.Move((r, c), (r, 6 if len(text) == 3 else 2), gs.board, isCastleMove=True)
+
+    match = SAN.match(text)
+    if match is None:
+        raise ValueError("bad SAN move: " + san)
+    pieceType, fromFile, fromRank, capture, target, promotion = match.groups()
+    endRow, endCol = ChessEngine.Move.ranksToRows[target[1]], ChessEngine.Move.filesToCols[target[0]]
+    if gs.board[endRow][endCol][0] == color:
+        raise ValueError("target square is taken: " + san)
+
+    if pieceType is None:
+        if promotion not in (None, 'Q'):
+            raise ValueError("only queen promotions are supported: " + san)
+        direction = 1 if gs.whiteToMove else -1  # rows towards our side of the board
+        if fromFile is not None and ChessEngine.Move.filesToCols[fromFile] != endCol:  # capture
+            start = (endRow + direction, ChessEngine.Move.filesToCols[fromFile])
+        elif 0 <= endRow + direction < 8 and gs.board[endRow + direction][endCol] == color + 'p':
+            start = (endRow + direction, endCol)
+        else:
+            start = (endRow + 2 * direction, endCol)
+        if not (0 <= start[0] < 8) or gs.board[start[0]][start[1]] != color + 'p':
+            raise ValueError("no pawn for: " + san)
+        isEnpassantMove = (endRow, endCol) == gs.enpassantPossible and start[1] != endCol
+        return ChessEngine.Move(start, (endRow, endCol), gs.board, isEnpassantMove=isEnpassantMove)
+
+    candidates = []
+    for value, r, c in gs.getAttackers(endRow, endCol, color):
+        if gs.board[r][c][1] == pieceType and (fromFile is None or ChessEngine.Move.filesToCols[fromFile] == c) \
+                and (fromRank is None or ChessEngine.Move.ranksToRows[fromRank] == r):
+            candidates.append(ChessEngine.Move((r, c), (endRow, endCol), gs.board))
+    if len(candidates) > 1:  # SAN doesn't disambiguate from pinned pieces
+        candidates = [move for move in candidates if isLegal(gs, move)]
+    if len(candidates) != 1:
+        raise ValueError(("ambiguous move: " if len(candidates) > 1 else "no piece for: ") + san)
+    return candidates[0]
+
+
+'''
+True if the move doesn't leave our king attacked
+'''
+def isLegal(gs, move):
+    color = move.pieceMoved[0]
+    gs.makeMove(move)
+    r, c = gs.whiteKingLocation if color == 'w' else gs.blackKingLocation
+    legal = len(gs.getAttackers(r, c, 'b' if color == 'w' else 'w')) == 0
+    gs.undoMove()
+    return legal
+
+
+'''
+The SAN of a move about to be played in gs. The move is made and taken back to find check and mate.
+'''
+def getSAN(gs, move):
+    if move.isCastleMove:
+        san = "O-O" if move.endCol == 6 else "O-O-O"
+    elif move.pieceMoved[1] == 'p':
+        san = move.getRankFile(move.endRow, move.endCol) + ("=Q" if move.isPawnPromotion else "")
+        if move.pieceCaptured != "--":
+            san = move.colsToFiles[move.startCol] + "x" + san
+    else:
+        others = []  # the other pieces of the same kind that can move to the same square
+        for value, r, c in gs.getAttackers(move.endRow, move.endCol, move.pieceMoved[0]):
+            if gs.board[r][c] == move.pieceMoved and (r, c) != (move.startRow, move.startCol) and \
+                    isLegal(gs, ChessEngine.Move((r, c), (move.endRow, move.endCol), gs.board)):
+                others.append((r, c))
+        disambiguation = ""
+        if len(others) > 0:
+            if all(c != move.startCol for r, c in others):
+                disambiguation = move.colsToFiles[move.startCol]
+            elif all(r != move.startRow for r, c in others):
+                disambiguation = move.rowsToRanks[move.startRow]
+            else:
+                disambiguation = move.getRankFile(move.startRow, move.startCol)
+        san = move.pieceMoved[1] + disambiguation + ("x" if move.pieceCaptured != "--" else "") + \
+              move.getRankFile(move.endRow, move.endCol)
+
+    gs.makeMove(move)
+    r, c = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
+    if len(gs.getAttackers(r, c, move.pieceMoved[0])) > 0:
+        san += "#" if len(gs.getValidMoves()) == 0 else "+"
+    gs.undoMove()
+    return san
+
+
+'''
+Write a game in PGN: the tags of headers, the seven tag roster first, then the moves of moveLog in SAN.
+fen is the starting position when the game didn't start from the initial one.
+'''
+def writeGame(output, moveLog, headers=None, fen=None):
+    headers = dict(headers) if headers is not None else {}
+    for tag in SEVEN_TAG_ROSTER:
+        headers.setdefault(tag, "????.??.??" if tag == "Date" else "*" if tag == "Result" else "?")
+    gs = ChessEngine.GameState()
+    if fen is not None:
+        gs.loadFEN(fen)
+        headers["SetUp"] = "1"
+        headers["FEN"] = fen
+    tags = list(SEVEN_TAG_ROSTER) + [tag for tag in headers if tag not in SEVEN_TAG_ROSTER]
+    for tag in tags:
+        output.write('[%s "%s"]\n' % (tag, str(headers[tag]).replace("\\", "\\\\").replace('"', '\\"')))
+    output.write("\n")
+
+    moveNumber = int(fen.split()[5]) if fen is not None and len(fen.split()) > 5 else 1
+    tokens = []
+    for move in moveLog:
+        if gs.whiteToMove:
+            tokens.append("%d." % moveNumber)
+        elif len(tokens) == 0:
+            tokens.append("%d..." % moveNumber)
+        tokens.append(getSAN(gs, move))
+        gs.makeMove(move)
+        if gs.whiteToMove:
+            moveNumber += 1
+    tokens.append(headers["Result"])
+
+    line = ""
+    for token in tokens:
+        if len(line) + 1 + len(token) > LINE_LENGTH:
+            output.write(line + "\n")
+            line = token
+        else:
+            line = token if line == "" else line + " " + token
+    output.write(line + "\n\n")
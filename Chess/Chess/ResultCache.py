@@ -0,0 +1,126 @@
+"""
+LRU cache of search results, keyed by the position (see positionKey) and the search limits. A result searched to
+some depth can also answer later requests for a smaller depth of the same position. The cache can be shared by
+threads, but their searches still run one at a time, SmartMoveFinder keeping its search state in module globals. A
+thread asking for a search that is already running waits for it and shares its result instead of queueing the same
+search again.
+
+The key doesn't include the move history, so a cached result may miss a repetition draw the search would have seen.
+"""
+
+import collections
+import threading
+
+from . import SmartMoveFinder
+
+CACHE_SIZE = 4096  # results
+
+
+'''
+The cache key of the position of gs: its zobrist key and the halfmove clock, the clock deciding how close the
+fifty-move rule is
+'''
+def positionKey(gs):
+    return gs.zobristKey, gs.halfmoveClock
+
+
+class ResultCache():
+    def __init__(self, size=CACHE_SIZE, reuseDeeper=True):
+        self.size = size
+        self.reuseDeeper = reuseDeeper  # answer a request with a result searched deeper than it asked for
+        self.entries = collections.OrderedDict()  # (position, limits) -> (depth, result), least recently used first
+        self.deepest = {}  # position -> limits of the entry of that position searched deepest
+        self.inFlight = {}  # (position, limits) -> threading.Event set when that search is done
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    '''
+    The result cached for the position, a positionKey, and limits, or else, if reuseDeeper, the deepest result of the position when
+    it was searched to at least depth. depth is None for requests limited by time or nodes only. Returns None on a miss.
+    '''
+    def lookup(self, position, limits, depth=None):
+        with self.lock:
+            key = (position, limits)
+            if key not in self.entries and self.reuseDeeper and depth is not None and position in self.deepest:
+                deepestKey = (position, self.deepest[position])
+                if self.entries[deepestKey][0] >= depth:
+                    key = deepestKey
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][1]
+
+    '''
+    Cache the result of a search of the position under limits that finished depth, None when the depth isn't known
+    '''
+    def store(self, position, limits, depth, result):
+        with self.lock:
+            key = (position, limits)
+            self.entries[key] = (depth, result)
+            self.entries.move_to_end(key)
+            if depth is not None:
+                deepestLimits = self.deepest.get(position)
+                if deepestLimits is None or self.entries[(position, deepestLimits)][0] < depth:
+                    self.deepest[position] = limits
+            while len(self.entries) > self.size:
+                (oldKey, oldLimits), entry = self.entries.popitem(last=False)
+                if self.deepest.get(oldKey) == oldLimits:
+                    del self.deepest[oldKey]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.deepest.clear()
+
+    '''
+    SmartMoveFinder.searchPosition through the cache. Returns (move, score, pv) like it, the move being one of
+    validMoves. Only iterations that finished are cached, each result under the depth it reached, so a search stopped
+    by its limits still answers later requests for that depth.
+    '''
+    def searchPosition(self, gs, validMoves, depth=SmartMoveFinder.DEPTH, nodeLimit=None, deadline=None,
+                       stopEvent=SmartMoveFinder.stopSearch):
+        position = positionKey(gs)
+        while True:
+            result = self.lookup(position, (depth,), depth)
+            if result is not None:
+                for move in validMoves:
+                    if move == result[0]:
+                        return move, result[1], result[2]
+            with self.lock:
+                event = self.inFlight.get((position, depth))
+                if event is None:
+                    event = threading.Event()
+                    self.inFlight[(position, depth)] = event
+                    break
+            event.wait()  # the same search is running on another thread, then look again
+            if stopEvent.is_set():
+                return None, 0, []
+
+        depthReached = 0
+
+        def onIteration(iterationDepth, score, pv):
+            nonlocal depthReached
+            depthReached = iterationDepth
+
+        try:
+            result = SmartMoveFinder.searchPosition(gs, validMoves, depth, nodeLimit, deadline, stopEvent, onIteration)
+            if result[0] is not None:
+                self.store(position, (depthReached,), depthReached, result)
+        finally:
+            with self.lock:
+                del self.inFlight[(position, depth)]
+            event.set()
+        return result
+
+    '''
+    SmartMoveFinder.findBestMove through the cache: a book move, else the move of the cached or new search
+    '''
+    def findBestMove(self, gs, validMoves, depth=SmartMoveFinder.DEPTH, nodeLimit=None, deadline=None,
+                     stopEvent=SmartMoveFinder.stopSearch):
+        bookMove = SmartMoveFinder.findBookMove(gs, validMoves)
+        if bookMove is not None:
+            return bookMove
+        return self.searchPosition(gs, validMoves, depth, nodeLimit, deadline, stopEvent)[0]
@@ -1,9 +1,66 @@
+import copy
 import random
+import threading
+import time
+
+from . import OpeningBook, Tablebase
 
 pieceScore = {"K" : 0, "Q" : 9, "R" : 5, "B" : 3, "N" : 3, "p" : 1}
 CHECKMATE = 1000
 STALEMATE = 0
 DEPTH = 2
+QUIESCENCE_DEPTH = 4  # captures searched after DEPTH runs out
+
+openingBook = OpeningBook.openBook()  # None when there is no book.bin next to this file
+
+# pawn structure terms, in pawns
+DOUBLED_PAWN = -0.25
+ISOLATED_PAWN = -0.2
+passedPawnScore = [0, 0.1, 0.15, 0.25, 0.4, 0.6, 1.0, 0]  # by ranks advanced from the starting rank
+PAWN_SHIELD = 0.1  # per pawn in front of a king on its first two ranks
+
+PAWN_HASH_SIZE = 1 << 14  # entries, a power of 2
+pawnHashTable = [None] * PAWN_HASH_SIZE
+
+EVAL_CACHE_BITS = 16
+EVAL_CACHE_SIZE = 1 << EVAL_CACHE_BITS
+evalCache = [None] * EVAL_CACHE_SIZE  # (upper bits of the key, score)
+
+# search state kept from move to move in a game, cleared by newGame()
+TT_SIZE = 1 << 16  # transposition table entries, a power of 2
+EXACT, LOWERBOUND, UPPERBOUND = 0, 1, 2
+transpositionTable = [None] * TT_SIZE  # (key, depth, score, flag, bestMoveID, generation)
+searchGeneration = 0  # one more for every search, entries of older searches are replaced first
+MAX_PLY = 64
+killerMoves = [[None, None] for i in range(MAX_PLY)]  # 2 quiet moveIDs per ply that caused a beta cutoff
+historyTable = {}  # (pieceMoved, endRow, endCol) -> how often it caused a cutoff, weighted by depth
+lastSearchPly = 0  # len(moveLog) at the last search, to shift the killers
+previousPV = (0, [])  # (len(moveLog), moveIDs) of the line the last search expected
+pvLine = []  # moveIDs searched first: what is left of the previous PV, then the PV of the last iteration
+followPV = False
+pvTable = [[None] * MAX_PLY for i in range(MAX_PLY)]  # triangular PV table, row ply holds the best line from ply on
+pvLength = [0] * MAX_PLY  # the line in row ply ends before pvLength[ply]
+
+searchLock = threading.Lock()  # held by the running search, the search state of this module is shared by all threads
+stopSearch = threading.Event()  # set to make a running search give up with the result of its last iteration
+
+# limits of the current search, looked at every CHECK_EVERY nodes
+CHECK_EVERY = 32
+searchStopEvent = stopSearch
+searchNodeLimit = None  # nodes, quiescence nodes included
+searchDeadline = None  # time.monotonic() value
+searchAborted = False
+
+# pondering: searching our reply to the predicted human move while the human thinks. Only the GUI thread starts,
+# stops or takes over the ponder search.
+ponderThread = None
+ponderStopEvent = None  # the ponder search's own stop event, nothing else sets or clears it
+ponderKey = None  # zobrist key of the position after the predicted move
+ponderMove = None  # our reply to it, once the ponder search is done
+
+# counters of the current search
+searchStats = {"nodes": 0, "quiescenceNodes": 0, "seePruned": 0, "ttHits": 0, "evalHits": 0, "evalMisses": 0,
+               "pawnHashHits": 0, "pawnHashMisses": 0}
 
 def findRandomMove(validMoves):
     return validMoves[random.randint(0, len(validMoves)-1)]
@@ -52,16 +109,262 @@ Min Max without recursive call
 Helper method to make the first recursive call
 '''
 
-def findBestMove(gs, validMoves):
-    global nextMove, counter
-    nextMove = None
-    random.shuffle(validMoves)
+def findBestMove(gs, validMoves, depth=DEPTH, nodeLimit=None, deadline=None, stopEvent=stopSearch):
+    bookMove = findBookMove(gs, validMoves)
+    if bookMove is not None:
+        return bookMove
     # findMoveMinMax(gs, validMoves, DEPTH, gs.whiteToMove)
     # findMoveNegaMax(gs, validMoves, DEPTH, 1 if gs.whiteToMove else -1)
-    counter = 0
-    findMoveNegaMaxAlphaBeta(gs, validMoves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
-    print(counter)
-    return nextMove
+    bestMove = searchPosition(gs, validMoves, depth, nodeLimit, deadline, stopEvent)[0]
+    print(searchStats)
+    return bestMove
+
+
+'''
+The move of the opening book for the position, None when there is no book or the position isn't in it
+'''
+
+def findBookMove(gs, validMoves):
+    if openingBook is None:
+        return None
+    return openingBook.findMove(gs, validMoves)
+
+
+'''
+Iterative deepening up to maxDepth, each iteration searching the PV of the one before first. The search gives up
+when stopEvent is set (from any thread), after nodeLimit nodes or at the time.monotonic() deadline.
+The search state is kept in this module, so searches started on several threads run one at a time.
+onIteration(depth, score, pv) is called after every iteration that finished.
+Returns (move, score for the side to move, pv) of the deepest iteration that finished. move is None if none did.
+'''
+
+def searchPosition(gs, validMoves, maxDepth=DEPTH, nodeLimit=None, deadline=None, stopEvent=stopSearch,
+                   onIteration=None):
+    global nextMove, pvLine, previousPV
+    with searchLock:
+        random.shuffle(validMoves)
+        for stat in searchStats:
+            searchStats[stat] = 0
+        startSearch(gs, nodeLimit, deadline, stopEvent)
+        result = (None, 0, [])
+        for depth in range(1, maxDepth + 1):
+            nextMove = None
+            score = findMoveNegaMaxAlphaBeta(gs, validMoves, depth, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
+            if searchAborted or nextMove is None:
+                break
+            result = (nextMove, score, getRootPV(nextMove))
+            pvLine = [move.moveID for move in result[2]]
+            if onIteration is not None:
+                onIteration(depth, score, result[2])
+        if result[0] is not None:
+            previousPV = (len(gs.moveLog), pvLine)
+        return result
+
+
+'''
+The PV of the last root search, from the triangular table. Just the move when it never raised alpha.
+'''
+
+def getRootPV(move):
+    pv = pvTable[0][:pvLength[0]]
+    if len(pv) == 0 or pv[0] != move:
+        return [move]
+    return pv
+
+
+'''
+Multi-PV analysis: the best count moves as (move, score for the side to move, pv) from best to worst, pv being the
+list of moves expected from move on. Iterative deepening up to maxDepth like searchPosition: each iteration searches
+every line again one ply deeper, the line's PV from the iteration before first. Each line searches the root without
+the moves of the lines before it, and all lines share the transposition table, so the later lines mostly hit entries
+of the first. Returns the lines of the deepest iteration that finished, none if the first didn't.
+'''
+
+def findBestMoves(gs, validMoves, count, maxDepth=DEPTH, nodeLimit=None, deadline=None, stopEvent=stopSearch):
+    global nextMove, pvLine
+    with searchLock:
+        for stat in searchStats:
+            searchStats[stat] = 0
+        startSearch(gs, nodeLimit, deadline, stopEvent)
+        lines = []
+        for depth in range(1, maxDepth + 1):
+            remainingMoves = list(validMoves)
+            iterationLines = []
+            while len(iterationLines) < count and len(remainingMoves) > 0:
+                if len(iterationLines) < len(lines):
+                    pvLine = [move.moveID for move in lines[len(iterationLines)][2]]
+                elif depth > 1:
+                    pvLine = []
+                nextMove = None
+                score = findMoveNegaMaxAlphaBeta(gs, remainingMoves, depth, -CHECKMATE, CHECKMATE,
+                                                 1 if gs.whiteToMove else -1)
+                if searchAborted or nextMove is None:
+                    return lines
+                iterationLines.append((nextMove, score, getRootPV(nextMove)))
+                remainingMoves.remove(nextMove)
+            lines = iterationLines
+        return lines
+
+
+'''
+Forget everything learned in the previous game
+'''
+
+def newGame():
+    global searchGeneration, historyTable, killerMoves, lastSearchPly, previousPV
+    with searchLock:
+        for i in range(TT_SIZE):
+            transpositionTable[i] = None
+        searchGeneration = 0
+        historyTable = {}
+        killerMoves = [[None, None] for i in range(MAX_PLY)]
+        lastSearchPly = 0
+        previousPV = (0, [])
+
+
+'''
+Several engines can play in one process by each keeping its own search state between its moves: the state kept from
+move to move, and the evaluation caches, which depend on the evaluation terms. getSearchState returns the state in use,
+setSearchState puts a state returned by getSearchState or newSearchState in its place. Nothing is copied.
+'''
+
+SEARCH_STATE = ("transpositionTable", "searchGeneration", "killerMoves", "historyTable", "lastSearchPly", "previousPV",
+                "evalCache", "pawnHashTable")
+
+
+def getSearchState():
+    return {name: globals()[name] for name in SEARCH_STATE}
+
+
+def setSearchState(state):
+    with searchLock:
+        globals().update(state)
+
+
+def newSearchState():
+    return {"transpositionTable": [None] * TT_SIZE, "searchGeneration": 0,
+            "killerMoves": [[None, None] for i in range(MAX_PLY)], "historyTable": {}, "lastSearchPly": 0,
+            "previousPV": (0, []), "evalCache": [None] * EVAL_CACHE_SIZE, "pawnHashTable": [None] * PAWN_HASH_SIZE}
+
+
+'''
+Prepare the state kept from the last search for this one: age the transposition table and history, move the killers
+to the plies they now belong to, and continue the previous PV if the game followed it. Also set the search limits.
+'''
+
+def startSearch(gs, nodeLimit=None, deadline=None, stopEvent=stopSearch):
+    global searchGeneration, killerMoves, lastSearchPly, pvLine
+    global searchStopEvent, searchNodeLimit, searchDeadline, searchAborted
+    searchStopEvent = stopEvent
+    searchNodeLimit = nodeLimit
+    searchDeadline = deadline
+    searchAborted = False
+    searchGeneration += 1
+    for key in historyTable:
+        historyTable[key] //= 2
+    shift = len(gs.moveLog) - lastSearchPly
+    if 0 <= shift < MAX_PLY:
+        killerMoves = killerMoves[shift:] + [[None, None] for i in range(shift)]
+    else:
+        killerMoves = [[None, None] for i in range(MAX_PLY)]
+    lastSearchPly = len(gs.moveLog)
+
+    pvPly, pv = previousPV
+    played = [move.moveID for move in gs.moveLog[pvPly:]]
+    pvLine = pv[len(played):] if 0 <= len(gs.moveLog) - pvPly and pv[:len(played)] == played else []
+
+
+def storeTransposition(key, depth, score, flag, bestMoveID):
+    index = key & (TT_SIZE - 1)
+    entry = transpositionTable[index]
+    if entry is None or entry[5] != searchGeneration or depth >= entry[1]:
+        transpositionTable[index] = (key, depth, score, flag, bestMoveID, searchGeneration)
+
+
+'''
+Start pondering on a copy of the game. Call it when it is the human's turn.
+'''
+
+def startPonder(gs):
+    global ponderThread, ponderStopEvent, ponderKey, ponderMove
+    stopPonder()
+    ponderKey = None
+    ponderMove = None
+    ponderStopEvent = threading.Event()
+    ponderThread = threading.Thread(target=ponder, args=(copy.deepcopy(gs), ponderStopEvent), daemon=True)
+    ponderThread.start()
+
+
+def ponder(gs, stopEvent):
+    global ponderKey, ponderMove
+    validMoves = gs.getValidMoves()
+    if len(validMoves) == 0:
+        return
+    predictedMove = predictMove(gs, validMoves, stopEvent)
+    if predictedMove is None:
+        return
+    gs.makeMove(predictedMove)
+    replies = gs.getValidMoves()
+    if len(replies) == 0:
+        return
+    ponderKey = gs.zobristKey
+    ponderMove = findBestMove(gs, replies, stopEvent=stopEvent)
+
+
+'''
+The human's reply we expect: the next move of the PV of our last search, or else what we would play in their place
+'''
+
+def predictMove(gs, validMoves, stopEvent=stopSearch):
+    pvPly, pv = previousPV
+    if len(gs.moveLog) == pvPly + 1 and len(pv) > 1 and gs.moveLog[-1].moveID == pv[0]:
+        for move in validMoves:
+            if move.moveID == pv[1]:
+                return move
+    return findBestMove(gs, validMoves, stopEvent=stopEvent)
+
+
+'''
+Stop the ponder search, if there is one, and wait for its thread
+'''
+
+def stopPonder():
+    global ponderThread
+    if ponderThread is not None:
+        ponderStopEvent.set()
+        ponderThread.join()
+        ponderThread = None
+
+
+'''
+Call before starting the search on our turn. If the human played the predicted move, the ponder search is handed
+over and (thread, stopEvent) of it returned, for waitPonder on the thread that would have searched. Otherwise stop
+pondering and return None.
+'''
+
+def ponderHit(gs):
+    global ponderThread
+    if ponderThread is None:
+        return None
+    if ponderKey != gs.zobristKey:
+        stopPonder()
+        return None
+    thread, ponderThread = ponderThread, None
+    return thread, ponderStopEvent
+
+
+'''
+Wait for a ponder search handed over by ponderHit and return its move from validMoves, None when it found none
+'''
+
+def waitPonder(thread, validMoves):
+    thread.join()
+    if ponderMove is None:
+        return None
+    for move in validMoves:
+        if move == ponderMove:
+            return move
+    return None
 
 def findMoveMinMax(gs, validMoves, depth, whiteToMove):
     global nextMove
@@ -72,8 +375,8 @@ def findMoveMinMax(gs, validMoves, depth, whiteToMove):
         maxScore = -CHECKMATE
         for move in validMoves:
             gs.makeMove(move)
-            nextMove = gs.getValidMoves()
-            score = findMoveMinMax(gs, nextMove, depth-1, False)
+            nextMoves = gs.getValidMoves()
+            score = findMoveMinMax(gs, nextMoves, depth-1, False)
             if score > maxScore:
                 maxScore = score
                 if depth == DEPTH:
@@ -85,8 +388,8 @@ def findMoveMinMax(gs, validMoves, depth, whiteToMove):
         minScore = CHECKMATE
         for move in validMoves:
             gs.makeMove(move)
-            nextMove = gs.getValidMoves()
-            score = findMoveMinMax(gs, nextMove, depth-1, True)
+            nextMoves = gs.getValidMoves()
+            score = findMoveMinMax(gs, nextMoves, depth-1, True)
             if score < minScore:
                 minScore = score
                 if depth == DEPTH:
@@ -96,8 +399,8 @@ def findMoveMinMax(gs, validMoves, depth, whiteToMove):
 
 
 def findMoveNegaMax(gs, validMoves, depth, turnMultiplier):
-    global nextMove, counter
-    counter += 1
+    global nextMove
+    searchStats["nodes"] += 1
 
     if depth == 0:
         return turnMultiplier * scoreBoard(gs)
@@ -105,8 +408,8 @@ def findMoveNegaMax(gs, validMoves, depth, turnMultiplier):
     maxScore = -CHECKMATE
     for move in validMoves:
         gs.makeMove(move)
-        nextMove = gs.getValidMoves()
-        score = -findMoveNegaMax(gs, nextMove, depth-1, -turnMultiplier)
+        nextMoves = gs.getValidMoves()
+        score = -findMoveNegaMax(gs, nextMoves, depth-1, -turnMultiplier)
         if score > maxScore:
             maxScore = score
             if depth==DEPTH:
@@ -115,32 +418,214 @@ def findMoveNegaMax(gs, validMoves, depth, turnMultiplier):
     return maxScore
 
 
-def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier):
-    global nextMove, counter
-    counter += 1
+def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier, ply=0):
+    global nextMove, followPV
+    searchStats["nodes"] += 1
+    pvLength[ply] = ply
+    if searchStopped():
+        return 0
+    if ply > 0: # the root still has to pick a move
+        if len(validMoves) == 0: # mate or stalemate, the game is over here
+            return -CHECKMATE if gs.checkmate else STALEMATE
+        if gs.isRepetition() or gs.isFiftyMoveDraw():
+            return STALEMATE
+        tablebaseScore = scoreTablebase(gs)
+        if tablebaseScore is not None:
+            return tablebaseScore
     if depth == 0:
-        return turnMultiplier * scoreBoard(gs)
+        return findMoveQuiescence(gs, validMoves, QUIESCENCE_DEPTH, alpha, beta, turnMultiplier)
+
+    alphaOriginal = alpha
+    ttMoveID = None
+    entry = transpositionTable[gs.zobristKey & (TT_SIZE - 1)]
+    if entry is not None and entry[0] == gs.zobristKey:
+        ttMoveID = entry[4]
+        if ply > 0 and entry[1] >= depth:
+            # an exact score inside the window makes this a PV node: search it, the entry has no line to give the PV
+            if (entry[3] == EXACT and not alpha < entry[2] < beta) or (entry[3] == LOWERBOUND and entry[2] >= beta) or \
+                    (entry[3] == UPPERBOUND and entry[2] <= alpha):
+                searchStats["ttHits"] += 1
+                return entry[2]
+    if ply == 0:
+        followPV = True
+    pvMoveID = pvLine[ply] if followPV and ply < len(pvLine) else None
     
     # move ordering 
     
     maxScore = -CHECKMATE
-    for move in validMoves:
+    bestMoveID = None
+    for move, see in orderMoves(gs, validMoves, ply, (pvMoveID, ttMoveID)):
         gs.makeMove(move)
-        nextMove = gs.getValidMoves()
-        score = -findMoveNegaMaxAlphaBeta(gs, nextMove, depth-1, -beta, -alpha, -turnMultiplier)
-        if score > maxScore:
+        nextMoves = gs.getValidMoves()
+        followPV = move.moveID == pvMoveID # only the first move of a PV node continues the PV
+        pvMoveID = None
+        if see is not None and see < 0 and depth >= 2: # losing capture, search it less deep unless it raises alpha
+            score = -findMoveNegaMaxAlphaBeta(gs, nextMoves, depth-2, -beta, -alpha, -turnMultiplier, ply+1)
+            if score > alpha:
+                score = -findMoveNegaMaxAlphaBeta(gs, nextMoves, depth-1, -beta, -alpha, -turnMultiplier, ply+1)
+        else:
+            score = -findMoveNegaMaxAlphaBeta(gs, nextMoves, depth-1, -beta, -alpha, -turnMultiplier, ply+1)
+        if score > maxScore or bestMoveID is None:
             maxScore = score
-            if depth==DEPTH:
+            bestMoveID = move.moveID
+            if ply == 0:
                 nextMove = move
         gs.undoMove()
         if maxScore>alpha: #purining happens
             alpha = maxScore
+            # new best line: this move followed by the child's line
+            pvTable[ply][ply] = move
+            for i in range(ply + 1, pvLength[ply + 1]):
+                pvTable[ply][i] = pvTable[ply + 1][i]
+            pvLength[ply] = max(pvLength[ply + 1], ply + 1)
         if alpha >= beta:
+            if move.pieceCaptured == "--": # remember quiet moves that refute
+                if ply < MAX_PLY and killerMoves[ply][0] != move.moveID:
+                    killerMoves[ply] = [move.moveID, killerMoves[ply][0]]
+                historyKey = (move.pieceMoved, move.endRow, move.endCol)
+                historyTable[historyKey] = historyTable.get(historyKey, 0) + depth * depth
             break
+
+    if not searchAborted:
+        if maxScore <= alphaOriginal:
+            flag = UPPERBOUND
+        elif maxScore >= beta:
+            flag = LOWERBOUND
+        else:
+            flag = EXACT
+        storeTransposition(gs.zobristKey, depth, maxScore, flag, bestMoveID)
     return maxScore
     
     
 
+'''
+Called at every node. Once it returns True every node returns at once, and the result of the interrupted iteration
+is thrown away. The limits are only looked at every CHECK_EVERY nodes.
+'''
+
+def searchStopped():
+    global searchAborted
+    if not searchAborted:
+        nodes = searchStats["nodes"] + searchStats["quiescenceNodes"]
+        if nodes % CHECK_EVERY == 0:
+            if searchStopEvent.is_set() or (searchNodeLimit is not None and nodes >= searchNodeLimit) or \
+                    (searchDeadline is not None and time.monotonic() >= searchDeadline):
+                searchAborted = True
+    return searchAborted
+
+
+'''
+Search captures only, until the position is quiet, so the leaves are not scored in the middle of an exchange.
+Captures that lose material by static exchange evaluation are skipped.
+'''
+
+def findMoveQuiescence(gs, validMoves, depth, alpha, beta, turnMultiplier):
+    searchStats["quiescenceNodes"] += 1
+    if searchStopped():
+        return 0
+    standPat = turnMultiplier * cachedScoreBoard(gs)
+    if depth == 0 or gs.checkmate or gs.stalemate or standPat >= beta:
+        return standPat
+    maxScore = standPat
+    if maxScore > alpha:
+        alpha = maxScore
+    for move, see in orderCaptures(gs, validMoves):
+        gs.makeMove(move)
+        nextMoves = gs.getValidMoves()
+        score = -findMoveQuiescence(gs, nextMoves, depth-1, -beta, -alpha, -turnMultiplier)
+        gs.undoMove()
+        if score > maxScore:
+            maxScore = score
+        if maxScore > alpha:
+            alpha = maxScore
+        if alpha >= beta:
+            break
+    return maxScore
+
+
+'''
+The captures of validMoves that don't lose material by static exchange evaluation, as (move, see) from the best
+exchange down. The losing ones are counted in searchStats["seePruned"].
+'''
+
+def orderCaptures(gs, validMoves):
+    captures = []
+    for move in validMoves:
+        if move.pieceCaptured != "--":
+            see = gs.see(move)
+            if see < 0:
+                searchStats["seePruned"] += 1
+            else:
+                captures.append((move, see))
+    captures.sort(key=lambda moveSee: moveSee[1], reverse=True)
+    return captures
+
+
+'''
+Order the moves as (move, see): the moves in firstMoveIDs (PV and transposition table moves), captures that win or
+trade material by their static exchange evaluation, the killers of the ply, the other quiet moves by their history
+score, then the losing captures. see is None for quiet moves.
+'''
+
+def orderMoves(gs, validMoves, ply=None, firstMoveIDs=()):
+    firstMoves = []
+    goodCaptures = []
+    killers = []
+    quietMoves = []
+    badCaptures = []
+    killerIDs = killerMoves[ply] if ply is not None and ply < MAX_PLY else ()
+    for move in validMoves:
+        see = gs.see(move) if move.pieceCaptured != "--" else None
+        if move.moveID in firstMoveIDs:
+            firstMoves.append((move, see))
+        elif see is not None:
+            (goodCaptures if see >= 0 else badCaptures).append((move, see))
+        elif move.moveID in killerIDs:
+            killers.append((move, see))
+        else:
+            quietMoves.append((move, see))
+    firstMoves.sort(key=lambda moveSee: firstMoveIDs.index(moveSee[0].moveID))
+    goodCaptures.sort(key=lambda moveSee: moveSee[1], reverse=True)
+    quietMoves.sort(key=lambda moveSee: historyTable.get((moveSee[0].pieceMoved, moveSee[0].endRow, moveSee[0].endCol), 0),
+                    reverse=True)
+    badCaptures.sort(key=lambda moveSee: moveSee[1], reverse=True)
+    return firstMoves + goodCaptures + killers + quietMoves + badCaptures
+
+
+'''
+Exact score from the endgame tablebases for the side to move, or None when there is no table for the position.
+A quicker mate scores higher.
+'''
+
+def scoreTablebase(gs):
+    result = Tablebase.probe(gs)
+    if result is None:
+        return None
+    outcome, plies = result
+    if outcome == Tablebase.WIN:
+        return CHECKMATE - plies
+    elif outcome == Tablebase.LOSS:
+        return -CHECKMATE + plies
+    return STALEMATE
+
+
+'''
+scoreBoard through the evaluation cache. The low bits of the position key pick the slot, the high bits check it.
+'''
+
+def cachedScoreBoard(gs):
+    index = gs.zobristKey & (EVAL_CACHE_SIZE - 1)
+    check = gs.zobristKey >> EVAL_CACHE_BITS
+    entry = evalCache[index]
+    if entry is not None and entry[0] == check:
+        searchStats["evalHits"] += 1
+        return entry[1]
+    searchStats["evalMisses"] += 1
+    score = scoreBoard(gs)
+    evalCache[index] = (check, score)
+    return score
+
+
 '''
 A positive score is good for white, negative for black
 '''
@@ -161,10 +646,82 @@ def scoreBoard(gs):
                 score += pieceScore[square[1]]
             elif square[0] == 'b':
                 score -= pieceScore[square[1]]
+
+    pawnScore, whiteShield, blackShield = probePawnHash(gs)
+    score += pawnScore
+    kingRow, kingCol = gs.whiteKingLocation
+    if kingRow >= 6:
+        score += PAWN_SHIELD * whiteShield[kingCol]
+    kingRow, kingCol = gs.blackKingLocation
+    if kingRow <= 1:
+        score -= PAWN_SHIELD * blackShield[kingCol]
     
     return score  
 
 
+'''
+Pawn structure terms from the pawn hash table. They depend on the pawns only, so they are computed again only when
+the pawns are new. Always replace on a miss.
+'''
+
+def probePawnHash(gs):
+    index = gs.pawnKey & (PAWN_HASH_SIZE - 1)
+    entry = pawnHashTable[index]
+    if entry is not None and entry[0] == gs.pawnKey:
+        searchStats["pawnHashHits"] += 1
+        return entry[1], entry[2], entry[3]
+    searchStats["pawnHashMisses"] += 1
+    pawnScore, whiteShield, blackShield = scorePawnStructure(gs.board)
+    pawnHashTable[index] = (gs.pawnKey, pawnScore, whiteShield, blackShield)
+    return pawnScore, whiteShield, blackShield
+
+
+'''
+Doubled, isolated and passed pawns (positive is good for white). Also, for each file a king can stand on, the number
+of pawns shielding it: pawns on the 2 ranks in front of the back rank, on the king file and the files next to it.
+'''
+
+def scorePawnStructure(board):
+    pawns = {'w': [], 'b': []}
+    files = {'w': [0] * 8, 'b': [0] * 8}
+    for r in range(8):
+        for c in range(8):
+            if board[r][c][1] == 'p':
+                color = board[r][c][0]
+                pawns[color].append((r, c))
+                files[color][c] += 1
+
+    score = 0
+    for color, sign in (('w', 1), ('b', -1)):
+        enemy = 'b' if color == 'w' else 'w'
+        for c in range(8):
+            if files[color][c] > 1:
+                score += sign * DOUBLED_PAWN * (files[color][c] - 1)
+        for r, c in pawns[color]:
+            neighbours = [col for col in (c - 1, c + 1) if 0 <= col < 8]
+            if all(files[color][col] == 0 for col in neighbours):
+                score += sign * ISOLATED_PAWN
+            # passed: no enemy pawn in front on this file or the files next to it
+            passed = True
+            for enemyRow, enemyCol in pawns[enemy]:
+                if abs(enemyCol - c) <= 1 and (enemyRow < r if color == 'w' else enemyRow > r):
+                    passed = False
+                    break
+            if passed:
+                score += sign * passedPawnScore[6 - r if color == 'w' else r - 1]
+
+    whiteShield = [0] * 8
+    blackShield = [0] * 8
+    for kingCol in range(8):
+        for r, c in pawns['w']:
+            if r >= 5 and abs(c - kingCol) <= 1:
+                whiteShield[kingCol] += 1
+        for r, c in pawns['b']:
+            if r <= 2 and abs(c - kingCol) <= 1:
+                blackShield[kingCol] += 1
+    return score, whiteShield, blackShield
+
+
 
 '''
 Score the board based on material
@@ -0,0 +1,338 @@
+"""
+Distance to mate endgame tablebases for positions with at most 4 pieces and no pawns. The tables are made by
+retrograde analysis and saved as one byte per position, addressed by an index built from the piece squares.
+They are memory mapped when probed.
+
+Generate tables with, for example:  python -m Chess.Tablebase KQvK KRvK KQvKR
+3 piece tables take under a minute. 4 piece tables have 64^4 squares per side to move and take a long time in python.
+"""
+
+import itertools
+import mmap
+import os
+import sys
+
+TABLEBASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases")
+MAX_PIECES = 4
+
+# probe results
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+pieceOrder = "KQRBN"
+pieceValue = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3}
+
+# squares are numbered row * 8 + col, like the board in ChessEngine
+kingDirections = ((0, -1), (0, 1), (1, 0), (-1, 0), (-1, -1), (1, 1), (1, -1), (-1, 1))
+knightDirections = ((2, -1), (2, 1), (-2, 1), (-2, -1), (1, -2), (1, 2), (-1, -2), (-1, 2))
+rookDirections = ((-1, 0), (0, -1), (1, 0), (0, 1))
+bishopDirections = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+
+def buildSteps(directions):
+    steps = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        steps.append([(r + d[0]) * 8 + c + d[1] for d in directions if 0 <= r + d[0] < 8 and 0 <= c + d[1] < 8])
+    return steps
+
+
+def buildRays(directions):
+    rays = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        squareRays = []
+        for d in directions:
+            ray = []
+            endRow, endCol = r + d[0], c + d[1]
+            while 0 <= endRow < 8 and 0 <= endCol < 8:
+                ray.append(endRow * 8 + endCol)
+                endRow += d[0]
+                endCol += d[1]
+            if len(ray) > 0:
+                squareRays.append(ray)
+        rays.append(squareRays)
+    return rays
+
+
+KING_STEPS = buildSteps(kingDirections)
+KNIGHT_STEPS = buildSteps(knightDirections)
+ROOK_RAYS = buildRays(rookDirections)
+BISHOP_RAYS = buildRays(bishopDirections)
+SLIDER_RAYS = {"R": ROOK_RAYS, "B": BISHOP_RAYS,
+               "Q": [ROOK_RAYS[sq] + BISHOP_RAYS[sq] for sq in range(64)]}
+
+'''
+Squares a piece on sq moves to or attacks. Sliders stop on the first occupied square, which is included.
+Moves are reversible without pawns, so this also gives the squares a piece could have come from.
+'''
+def destinations(pieceType, sq, occupied):
+    if pieceType == 'K':
+        return KING_STEPS[sq]
+    if pieceType == 'N':
+        return KNIGHT_STEPS[sq]
+    squares = []
+    for ray in SLIDER_RAYS[pieceType][sq]:
+        for target in ray:
+            squares.append(target)
+            if target in occupied:
+                break
+    return squares
+
+
+def isAttacked(target, pieces, sqs, color, occupied):
+    for i in range(len(pieces)):
+        if pieces[i][0] == color and target in destinations(pieces[i][1], sqs[i], occupied):
+            return True
+    return False
+
+
+def kingIndex(pieces, color):
+    return pieces.index(color + 'K')
+
+
+'''
+Signature of a material configuration, strongest side first. e.g. ["wK", "bK", "wQ"] -> "KQvK"
+'''
+def sideKey(types):
+    return (-sum(pieceValue[t] for t in types), [pieceOrder.index(t) for t in types])
+
+
+def sortTypes(types):
+    return "".join(sorted(types, key=pieceOrder.index))
+
+
+def signaturePieces(signature):
+    white, black = signature.split("v")
+    return ["w" + t for t in white] + ["b" + t for t in black]
+
+
+def mirror(sq):
+    return (7 - sq // 8) * 8 + sq % 8
+
+
+'''
+Map a position, given as (piece, square) pairs and the side to move (0 white, 1 black), to its table signature and
+index. When black has the stronger material the board is mirrored and the colors swapped.
+'''
+def tableIndex(pieceSquares, stm):
+    white = sortTypes([piece[1] for piece, sq in pieceSquares if piece[0] == 'w'])
+    black = sortTypes([piece[1] for piece, sq in pieceSquares if piece[0] == 'b'])
+    if sideKey(black) < sideKey(white):
+        pieceSquares = [(('b' if piece[0] == 'w' else 'w') + piece[1], mirror(sq)) for piece, sq in pieceSquares]
+        white, black = black, white
+        stm = 1 - stm
+    pieceSquares = sorted(pieceSquares, key=lambda ps: (ps[0][0] == 'b', pieceOrder.index(ps[0][1])))
+    index = stm
+    for piece, sq in pieceSquares:
+        index = index * 64 + sq
+    return white + "v" + black, index
+
+
+def tableFile(signature, directory=TABLEBASE_PATH):
+    return os.path.join(directory, signature + ".bin")
+
+
+'''
+Every 2 piece position and every king and minor piece against a bare king is a draw
+'''
+def isDrawnMaterial(signature):
+    return signature in ("KvK", "KBvK", "KNvK")
+
+
+'''
+Build the table for the signature by retrograde analysis. subTables maps signatures to the tables reached by a
+capture. A table entry is 0 for draws and illegal positions, otherwise 1 + the number of plies to mate. An odd number
+of plies means the side to move wins.
+'''
+def generate(signature, subTables):
+    pieces = signaturePieces(signature)
+    n = len(pieces)
+    size = 64 ** n
+    multiplier = [64 ** (n - 1 - i) for i in range(n)]
+    values = bytearray(2 * size)
+    counts = bytearray(2 * size)  # legal moves not yet known to lose
+    legal = bytearray(2 * size)
+    buckets = {}  # plies -> events
+    WIN_EVENT, LOSS_EVENT, LOSING_MOVE_EVENT = 0, 1, 2
+
+    def schedule(plies, kind, index):
+        buckets.setdefault(plies, []).append((kind, index))
+
+    # 1. legal positions, their number of moves, checkmates and the results of captures
+    for sqs in itertools.product(range(64), repeat=n):
+        if len(set(sqs)) < n:
+            continue
+        base = sum(sqs[i] * multiplier[i] for i in range(n))
+        occupied = set(sqs)
+        for stm in (0, 1):
+            color, enemy = ('w', 'b') if stm == 0 else ('b', 'w')
+            enemyKing = sqs[kingIndex(pieces, enemy)]
+            if isAttacked(enemyKing, pieces, sqs, color, occupied):
+                continue  # the side that just moved is in check
+            index = stm * size + base
+            legal[index] = 1
+            moveCount = 0
+            for i in range(n):
+                if pieces[i][0] != color:
+                    continue
+                for target in destinations(pieces[i][1], sqs[i], occupied):
+                    captured = sqs.index(target) if target in occupied else -1
+                    if captured >= 0 and pieces[captured][0] == color:
+                        continue
+                    newPieces = [pieces[j] for j in range(n) if j != captured]
+                    newSqs = [target if j == i else sqs[j] for j in range(n) if j != captured]
+                    king = newSqs[kingIndex(newPieces, color)]
+                    if isAttacked(king, newPieces, newSqs, enemy, set(newSqs)):
+                        continue
+                    moveCount += 1
+                    if captured >= 0:
+                        value = probeTable(subTables, list(zip(newPieces, newSqs)), 1 - stm)
+                        if value > 0:
+                            plies = value - 1
+                            schedule(plies + 1, LOSING_MOVE_EVENT if plies % 2 == 1 else WIN_EVENT, index)
+            counts[index] = moveCount
+            if moveCount == 0 and isAttacked(sqs[kingIndex(pieces, color)], pieces, sqs, enemy, occupied):
+                schedule(0, LOSS_EVENT, index)
+
+    def predecessors(index):
+        stm, base = divmod(index, size)
+        sqs = []
+        rest = base
+        for i in range(n):
+            sq, rest = divmod(rest, multiplier[i])
+            sqs.append(sq)
+        occupied = set(sqs)
+        mover = 'b' if stm == 0 else 'w'
+        for i in range(n):
+            if pieces[i][0] != mover:
+                continue
+            for origin in destinations(pieces[i][1], sqs[i], occupied):
+                if origin in occupied:
+                    continue
+                q = (1 - stm) * size + base + (origin - sqs[i]) * multiplier[i]
+                if legal[q]:
+                    yield q
+
+    # 2. walk back from the mates one ply at a time
+    plies = 0
+    while len(buckets) > 0:
+        events = buckets.pop(plies, [])
+        i = 0
+        while i < len(events):
+            kind, index = events[i]
+            i += 1
+            if values[index] != 0:
+                continue
+            if kind == LOSING_MOVE_EVENT:
+                counts[index] -= 1
+                if counts[index] == 0:  # every move loses
+                    events.append((LOSS_EVENT, index))
+                continue
+            if plies + 1 > 255:
+                raise ValueError("distance to mate does not fit in a byte: " + signature)
+            values[index] = plies + 1
+            for q in predecessors(index):
+                schedule(plies + 1, LOSING_MOVE_EVENT if kind == WIN_EVENT else WIN_EVENT, q)
+        plies += 1
+    return values
+
+
+def probeTable(tables, pieceSquares, stm):
+    signature, index = tableIndex(pieceSquares, stm)
+    if len(pieceSquares) == 2 or isDrawnMaterial(signature):
+        return 0
+    return tables[signature][index]
+
+
+'''
+Signatures of the tables reachable by one capture
+'''
+def subSignatures(signature):
+    pieces = signaturePieces(signature)
+    signatures = set()
+    for i in range(len(pieces)):
+        if pieces[i][1] != 'K':
+            rest = [(pieces[j], 0) for j in range(len(pieces)) if j != i]
+            subSignature = tableIndex(rest, 0)[0]
+            if len(rest) > 2 and not isDrawnMaterial(subSignature):
+                signatures.add(subSignature)
+    return signatures
+
+
+'''
+Generate the table and the tables it depends on, saving each one in directory. Existing files are reused.
+'''
+def buildTable(signature, directory=TABLEBASE_PATH, tables=None):
+    if tables is None:
+        tables = {}
+    signature = tableIndex([(piece, 0) for piece in signaturePieces(signature)], 0)[0]
+    if signature in tables:
+        return tables[signature]
+    path = tableFile(signature, directory)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            tables[signature] = f.read()
+        return tables[signature]
+    for subSignature in subSignatures(signature):
+        buildTable(subSignature, directory, tables)
+    print("generating " + signature)
+    values = generate(signature, tables)
+    os.makedirs(directory, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(values)
+    tables[signature] = values
+    return values
+
+
+'''
+Probing from the search
+'''
+
+mappedTables = {}  # signature -> mmap, or None when there is no file
+
+
+def getTable(signature):
+    if signature not in mappedTables:
+        path = tableFile(signature, TABLEBASE_PATH)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                mappedTables[signature] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            mappedTables[signature] = None
+    return mappedTables[signature]
+
+
+'''
+Look the position up. Returns (WIN/DRAW/LOSS for the side to move, plies to mate), or None when there is no table
+for the position. Positions with castling rights or pawns are never in a table.
+'''
+def probe(gs):
+    rights = gs.currentCastingRight
+    if rights.wks or rights.wqs or rights.bks or rights.bqs:
+        return None
+    pieceSquares = []
+    for r in range(8):
+        for c in range(8):
+            piece = gs.board[r][c]
+            if piece != "--":
+                if piece[1] == 'p' or len(pieceSquares) == MAX_PIECES:
+                    return None
+                pieceSquares.append((piece, r * 8 + c))
+    signature, index = tableIndex(pieceSquares, 0 if gs.whiteToMove else 1)
+    if len(pieceSquares) == 2 or isDrawnMaterial(signature):
+        return DRAW, 0
+    table = getTable(signature)
+    if table is None:
+        return None
+    value = table[index]
+    if value == 0:
+        return DRAW, 0
+    plies = value - 1
+    return (WIN if plies % 2 == 1 else LOSS), plies
+
+
+if __name__ == "__main__":
+    for signature in sys.argv[1:]:
+        buildTable(signature)
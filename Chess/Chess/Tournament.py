@@ -0,0 +1,272 @@
+"""
+Self-play matches between two engine configurations, to tell whether a change makes the engine stronger. Every
+opening of the suite is played twice, once with each engine as white, and the games run in a pool of processes.
+The result is reported as wins/draws/losses of the first engine, its Elo difference with a 95% error bar and,
+with --sprt, a sequential probability ratio test verdict that also ends the match as soon as it is reached.
+
+    chess-tournament --engine new:depth=3,DOUBLED_PAWN=-0.4 --engine base:depth=3 --rounds 200 --sprt 0 20
+
+An engine is a name followed by search limits (depth, movetime in milliseconds, nodes) and any number of the
+SmartMoveFinder evaluation and search terms in TUNABLE to change for it.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import math
+import os
+import re
+import sys
+import time
+
+from . import BatchAnalysis, ChessEngine, Pgn, SmartMoveFinder, Tablebase, UciEngine
+
+MAX_DEPTH = 32  # for engines limited by time or nodes only
+LIMITS = ("depth", "movetime", "nodes")
+REPORT_EVERY = 50  # games
+UCI_MOVE = re.compile(r'^[a-h][1-8][a-h][1-8][qrbn]?$')
+# SmartMoveFinder constants an engine may change. The others size tables or encode scores and flags.
+TUNABLE = ("DOUBLED_PAWN", "ISOLATED_PAWN", "PAWN_SHIELD", "QUIESCENCE_DEPTH")
+
+# played from the initial position when no suite is given
+DEFAULT_OPENINGS = [
+    "e4 e5 Nf3 Nc6", "e4 c5 Nf3 d6", "e4 e6 d4 d5", "e4 c6 d4 d5", "d4 d5 c4 e6", "d4 Nf6 c4 g6",
+    "d4 Nf6 c4 e6", "c4 e5 Nc3 Nf6", "Nf3 d5 g3 Nf6", "e4 e5 Nf3 Nf6", "d4 d5 c4 c6", "e4 d5 exd5 Qxd5",
+]
+
+
+'''
+"name:depth=3,movetime=100,DOUBLED_PAWN=-0.4" -> (name, {limit: value}, {constant: value})
+'''
+def parseEngine(text):
+    name, _, options = text.partition(":")
+    limits = {}
+    constants = {}
+    for option in options.split(","):
+        if option == "":
+            continue
+        key, _, value = option.partition("=")
+        number = float(value)
+        if number == int(number):
+            number = int(number)
+        if key in LIMITS:
+            limits[key] = number
+        elif key in TUNABLE:
+            constants[key] = number
+        else:
+            raise ValueError("unknown engine option: " + key)
+    if len(limits) == 0:
+        limits["depth"] = SmartMoveFinder.DEPTH
+    return name, limits, constants
+
+
+'''
+Openings as (fen, moves) pairs. A .pgn suite gives the moves of its games, any other file EPD/FEN lines or lines of
+SAN moves from the initial position.
+'''
+def loadOpenings(path):
+    if path is None:
+        return [(None, line.split()) for line in DEFAULT_OPENINGS]
+    openings = []
+    with open(path) as f:
+        if path.endswith(".pgn"):
+            for headers, gs in Pgn.readGames(f):
+                openings.append((headers.get("FEN"), [move.getUciNotation() for move in gs.moveLog]))
+            return openings
+        for line in f:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            if line.split()[0].count("/") == 7:
+                openings.append((BatchAnalysis.parsePosition(line)[0], []))
+            else:
+                openings.append((None, line.split()))
+    return openings
+
+
+defaults = {}  # TUNABLE constants before any engine changed them
+
+
+def initWorker():
+    SmartMoveFinder.openingBook = None  # the suite picks the openings
+    defaults.update({name: getattr(SmartMoveFinder, name) for name in TUNABLE})
+
+
+'''
+Make SmartMoveFinder play as an engine: its constants set, and its search state, as its last move left it, in place
+'''
+def applyEngine(constants, searchState):
+    for name, value in defaults.items():
+        setattr(SmartMoveFinder, name, constants.get(name, value))
+    SmartMoveFinder.setSearchState(searchState)
+
+
+def findMove(gs, validMoves, limits):
+    deadline = time.monotonic() + limits["movetime"] / 1000 if "movetime" in limits else None
+    depth = limits.get("depth", MAX_DEPTH)
+    move = SmartMoveFinder.searchPosition(gs, validMoves, depth, limits.get("nodes"), deadline)[0]
+    return move if move is not None else SmartMoveFinder.findRandomMove(validMoves)
+
+
+'''
+Runs in a worker process. Plays one game and returns (result, reason, fen, moveLog), result for white.
+'''
+def playGame(opening, white, black):
+    fen, openingMoves = opening
+    gs = ChessEngine.GameState()
+    if fen is not None:
+        gs.loadFEN(fen)
+    for text in openingMoves:  # SAN, or UCI from a .pgn suite
+        move = UciEngine.parseMove(gs, text) if UCI_MOVE.match(text) else Pgn.parseSAN(gs, text)
+        if move is None:
+            raise ValueError("bad opening move: " + text)
+        gs.makeMove(move)
+
+    engines = (white, black)
+    # each engine keeps its transposition table, killers, history and caches from move to move, as in the GUI
+    searchStates = [SmartMoveFinder.newSearchState(), SmartMoveFinder.newSearchState()]
+    while True:
+        validMoves = gs.getValidMoves()
+        gameResult = gs.getResult(ChessEngine.MAX_PLIES)
+        if gameResult is not None:
+            return gameResult[0], gameResult[1], fen, gs.moveLog
+        probe = Tablebase.probe(gs)
+        if probe is not None:  # adjudicate by the tablebases
+            outcome = probe[0]
+            if outcome == Tablebase.DRAW:
+                return "1/2-1/2", "tablebase", fen, gs.moveLog
+            whiteWins = (outcome == Tablebase.WIN) == gs.whiteToMove
+            return ("1-0" if whiteWins else "0-1"), "tablebase", fen, gs.moveLog
+        side = 0 if gs.whiteToMove else 1
+        applyEngine(engines[side][2], searchStates[side])
+        gs.makeMove(findMove(gs, validMoves, engines[side][1]))
+        searchStates[side] = SmartMoveFinder.getSearchState()
+
+
+'''
+Logistic Elo difference of a score between 0 and 1
+'''
+def eloFromScore(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def scoreFromElo(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+'''
+(Elo difference, half width of its 95% confidence interval) from the wins, draws and losses of the first engine
+'''
+def eloDifference(wins, draws, losses):
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    return eloFromScore(score), (eloFromScore(score + margin) - eloFromScore(score - margin)) / 2
+
+
+'''
+Log likelihood ratio of elo1 against elo0, with the normal approximation of the game scores
+'''
+def sprtLLR(wins, draws, losses, elo0, elo1):
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    if variance == 0:  # every game ended the same so far
+        return 0.0
+    score0, score1 = scoreFromElo(elo0), scoreFromElo(elo1)
+    return games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+
+
+'''
+"H1" when the first engine is at least elo1 stronger, "H0" when it is at most elo0 stronger, else None
+'''
+def sprtVerdict(wins, draws, losses, elo0, elo1, alpha=0.05, beta=0.05):
+    llr = sprtLLR(wins, draws, losses, elo0, elo1)
+    if llr >= math.log((1 - beta) / alpha):
+        return "H1"
+    if llr <= math.log(beta / (1 - alpha)):
+        return "H0"
+    return None
+
+
+def report(names, wins, draws, losses, sprt, output):
+    games = wins + draws + losses
+    elo, margin = eloDifference(wins, draws, losses)
+    output.write("%s vs %s: %d games, +%d =%d -%d, score %.1f%%, Elo %+.1f +/- %.1f\n" % (
+        names[0], names[1], games, wins, draws, losses, 100 * (wins + draws / 2) / games, elo, margin))
+    if sprt is not None:
+        elo0, elo1 = sprt
+        verdict = sprtVerdict(wins, draws, losses, elo0, elo1)
+        output.write("SPRT [%g, %g]: LLR %.2f (%.2f, %.2f) %s\n" % (
+            elo0, elo1, sprtLLR(wins, draws, losses, elo0, elo1), math.log(0.05 / 0.95), math.log(0.95 / 0.05),
+            {"H1": "H1 accepted", "H0": "H0 accepted", None: "inconclusive"}[verdict]))
+    output.flush()
+
+
+'''
+Play rounds passes over the openings, each opening once with each engine as white. Returns (wins, draws, losses) of
+the first engine. Games are written to pgnOutput when given.
+'''
+def runMatch(first, second, openings, rounds, workers, sprt=None, pgnOutput=None, output=sys.stdout):
+    games = [(opening, (first, second) if i % 2 == 0 else (second, first))
+             for r in range(rounds) for opening in openings for i in range(2)]
+    games.reverse()  # popped from the end
+    results = collections.Counter()
+    reported = 0
+    pending = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=initWorker) as pool:
+        while len(games) > 0 or len(pending) > 0:
+            while len(games) > 0 and len(pending) < 2 * workers:
+                opening, (white, black) = games.pop()
+                pending[pool.submit(playGame, opening, white, black)] = (white, black)
+            done = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)[0]
+            for future in done:
+                white, black = pending.pop(future)
+                result, reason, fen, moveLog = future.result()
+                if result == "1/2-1/2":
+                    results["draws"] += 1
+                elif (result == "1-0") == (white is first):
+                    results["wins"] += 1
+                else:
+                    results["losses"] += 1
+                if pgnOutput is not None:
+                    Pgn.writeGame(pgnOutput, moveLog, {"Event": "Tournament", "White": white[0], "Black": black[0],
+                                                       "Result": result, "Termination": reason}, fen)
+            if sprt is not None and sprtVerdict(results["wins"], results["draws"], results["losses"], *sprt):
+                games = []  # decided, finish the games already running
+            if sum(results.values()) >= reported + REPORT_EVERY:
+                reported = sum(results.values())
+                report((first[0], second[0]), results["wins"], results["draws"], results["losses"], sprt, output)
+    return results["wins"], results["draws"], results["losses"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="self-play match between two engine configurations")
+    parser.add_argument("--engine", action="append", required=True, type=parseEngine,
+                        help="name:option=value,... given twice, the first engine is the one measured")
+    parser.add_argument("--openings", help="opening suite: .pgn, EPD/FEN lines or lines of SAN moves")
+    parser.add_argument("--rounds", type=int, default=1, help="passes over the suite, 2 games per opening each")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--sprt", type=float, nargs=2, metavar=("ELO0", "ELO1"),
+                        help="stop once the first engine is known to be ELO0 or ELO1 stronger")
+    parser.add_argument("--pgn", help="file to write the games to")
+    args = parser.parse_args()
+    if len(args.engine) != 2:
+        parser.error("give exactly two engines")
+
+    pgnOutput = open(args.pgn, "w") if args.pgn is not None else None
+    try:
+        wins, draws, losses = runMatch(args.engine[0], args.engine[1], loadOpenings(args.openings), args.rounds,
+                                       args.workers, args.sprt, pgnOutput)
+    finally:
+        if pgnOutput is not None:
+            pgnOutput.close()
+    report((args.engine[0][0], args.engine[1][0]), wins, draws, losses, args.sprt, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Headless UCI (Universal Chess Interface) front-end for the engine, so it can be run by tournament managers and chess
+GUIs without a display. Reads commands on stdin and writes replies on stdout:  chess-uci
+The search runs on a worker thread, so "stop" and "isready" are answered while it thinks.
+"""
+
+import sys
+import threading
+import time
+
+from . import ChessEngine, SmartMoveFinder
+
+ENGINE_NAME = "ChessGame-AI"
+ENGINE_AUTHOR = "ibnesina"
+MAX_DEPTH = 32  # for searches limited by time or stopped by "stop" only
+MOVES_TO_GO = 30  # moves the remaining clock time is shared between when the GUI doesn't say
+
+
+class UciEngine():
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.outputLock = threading.Lock()
+        self.gs = ChessEngine.GameState()
+        self.searchThread = None
+        self.stopEvent = threading.Event()
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    '''
+    Handle one command line. Returns False on "quit". A command that can't be understood is answered with an
+    "info string" and otherwise ignored.
+    '''
+    def handle(self, line):
+        tokens = line.split()
+        if len(tokens) == 0:
+            return True
+        command = tokens[0]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.stop()
+            SmartMoveFinder.newGame()
+            self.gs = ChessEngine.GameState()
+        elif command == "position":
+            self.stop()
+            try:
+                self.setPosition(tokens[1:])
+            except (ValueError, IndexError, KeyError):
+                self.send("info string bad position, keeping the last one: " + line.strip())
+        elif command == "go":
+            self.stop()
+            try:
+                self.go(tokens[1:])
+            except ValueError:
+                self.send("info string bad go command: " + line.strip())
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            self.stop()
+            return False
+        return True
+
+    '''
+    position [startpos | fen <fen>] [moves <move> ...]
+    Raises ValueError, IndexError or KeyError for a position the engine can't play from, leaving self.gs as it was.
+    '''
+    def setPosition(self, tokens):
+        gs = ChessEngine.GameState()
+        movesAt = tokens.index("moves") if "moves" in tokens else len(tokens)
+        if len(tokens) > 0 and tokens[0] == "fen":
+            gs.loadFEN(" ".join(tokens[1:movesAt]))
+        for text in tokens[movesAt + 1:]:
+            move = parseMove(gs, text)
+            if move is None:
+                self.send("info string illegal move " + text)
+                break
+            gs.makeMove(move)
+        self.gs = gs
+
+    '''
+    go [depth n] [nodes n] [movetime ms] [wtime ms] [btime ms] [winc ms] [binc ms] [movestogo n] [infinite]
+    '''
+    def go(self, tokens):
+        limits = {}
+        for i in range(len(tokens) - 1):
+            if tokens[i] in ("depth", "nodes", "movetime", "wtime", "btime", "winc", "binc", "movestogo"):
+                limits[tokens[i]] = int(tokens[i + 1])
+        maxDepth = limits.get("depth", MAX_DEPTH if "infinite" in tokens else None)
+        deadline = None
+        clock = limits.get("wtime" if self.gs.whiteToMove else "btime")
+        if "movetime" in limits:
+            deadline = time.monotonic() + limits["movetime"] / 1000
+        elif clock is not None:
+            increment = limits.get("winc" if self.gs.whiteToMove else "binc", 0)
+            moveTime = min(clock / limits.get("movestogo", MOVES_TO_GO) + increment / 2, clock / 2)
+            deadline = time.monotonic() + moveTime / 1000
+        if maxDepth is None:
+            maxDepth = MAX_DEPTH if deadline is not None or "nodes" in limits else SmartMoveFinder.DEPTH
+        self.stopEvent.clear()
+        self.searchThread = threading.Thread(target=self.search,
+                                             args=(maxDepth, limits.get("nodes"), deadline, "infinite" in tokens),
+                                             daemon=True)
+        self.searchThread.start()
+
+    '''
+    Runs on the search thread. With infinite, bestmove waits for "stop" even when the search ends before it, as the
+    protocol asks.
+    '''
+    def search(self, maxDepth, nodeLimit, deadline, infinite=False):
+        startTime = time.monotonic()
+        validMoves = self.gs.getValidMoves()
+        if len(validMoves) == 0:
+            if infinite:
+                self.stopEvent.wait()
+            self.send("bestmove 0000")
+            return
+        bestMove = SmartMoveFinder.findBookMove(self.gs, validMoves)
+        if bestMove is None:
+
+            def report(depth, score, pv):
+                stats = SmartMoveFinder.searchStats
+                elapsed = int((time.monotonic() - startTime) * 1000)
+                self.send("info depth %d score %s nodes %d time %d pv %s" % (
+                    depth, formatScore(score), stats["nodes"] + stats["quiescenceNodes"], elapsed,
+                    " ".join(move.getUciNotation() for move in pv)))
+
+            bestMove = SmartMoveFinder.searchPosition(self.gs, validMoves, maxDepth, nodeLimit, deadline,
+                                                      self.stopEvent, report)[0]
+        if bestMove is None: # stopped before the first iteration finished
+            bestMove = SmartMoveFinder.findRandomMove(validMoves)
+        if infinite:
+            self.stopEvent.wait()
+        self.send("bestmove " + bestMove.getUciNotation())
+
+    '''
+    Stop the search, if there is one. Its bestmove is sent before this returns.
+    '''
+    def stop(self):
+        if self.searchThread is not None:
+            self.stopEvent.set()
+            self.searchThread.join()
+            self.searchThread = None
+
+    def run(self, input=sys.stdin):
+        for line in input:
+            if not self.handle(line):
+                break
+        self.stop()
+
+
+'''
+The valid move in UCI notation. We only promote to a queen, so any promotion piece is read as a queen.
+'''
+def parseMove(gs, text):
+    for move in gs.getValidMoves():
+        if move.getChessNotation() == text[:4]:
+            return move
+    return None
+
+
+'''
+Scores are in pawns. The search scores every mate as CHECKMATE however far away it is, so mates can't be given as
+"mate <moves>" and are sent as centipawns like any other score.
+'''
+def formatScore(score):
+    return "cp %d" % round(score * 100)
+
+
+def main():
+    UciEngine().run()
+
+
+if __name__ == "__main__":
+    main()
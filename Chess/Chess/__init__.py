@@ -0,0 +1,4 @@
+"""
+Chess with AI. The engine modules (ChessEngine, SmartMoveFinder and the tools built on them) don't need pygame, only
+ChessMain, the game window, does. Nothing is imported here so importing the engine stays fast.
+"""
@@ -0,0 +1,4 @@
+# python -m Chess starts the game
+from .ChessMain import main
+
+main()
@@ -1 +1,4 @@
 # run chessMain.py
+from Chess.ChessMain import main
+
+main()